@@ -0,0 +1,93 @@
+# earnings_agent/llm/llm_cache.py
+
+import os
+import time
+import zlib
+import sqlite3
+import hashlib
+import logging
+from contextlib import closing
+from pathlib import Path
+from typing import Optional, Union
+
+# Configuration
+# Persistent, content-addressed cache of LLM responses. Keys hash everything that determines the
+# response (input bytes, prompt, model, parser version), so an identical re-run (e.g. reprocessing
+# an EXTRACTION_ERROR on the same PDF) is a local lookup instead of a Vertex AI call.
+# Set EARNINGS_LLM_CACHE_PATH to an empty string to disable.
+_DEFAULT_CACHE_PATH = Path(__file__).resolve().parents[1] / "storage" / "data" / "llm_cache.sqlite3"
+LLM_CACHE_PATH = os.getenv("EARNINGS_LLM_CACHE_PATH", str(_DEFAULT_CACHE_PATH))
+LLM_CACHE_TIMEOUT = 10  # seconds to wait on a locked database
+
+logger = logging.getLogger(__name__)
+
+_schema_ready = False
+
+def _connect() -> Optional[sqlite3.Connection]:
+    """
+    Open a connection (one per call: safe across threads and worker processes),
+    creating the table on first use. Returns None when the cache is disabled.
+    """
+    global _schema_ready
+    if not LLM_CACHE_PATH:
+        return None
+    if not _schema_ready:
+        Path(LLM_CACHE_PATH).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(LLM_CACHE_PATH, timeout=LLM_CACHE_TIMEOUT)
+    if not _schema_ready:
+        try:
+            # WAL lets concurrent workers read while one writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_responses "
+                "(key TEXT PRIMARY KEY, response BLOB NOT NULL, created_at INTEGER NOT NULL)"
+            )
+            conn.commit()
+        except sqlite3.Error:
+            conn.close()
+            raise
+        _schema_ready = True
+    return conn
+
+def make_cache_key(*parts: Union[bytes, str]) -> str:
+    """SHA-256 over the length-prefixed parts, so ('ab', 'c') and ('a', 'bc') never collide."""
+    h = hashlib.sha256()
+    for part in parts:
+        data = part.encode("utf-8") if isinstance(part, str) else part
+        h.update(len(data).to_bytes(8, "big"))
+        h.update(data)
+    return h.hexdigest()
+
+def get_cached_response(key: str) -> Optional[str]:
+    """Return the cached response text for `key`, or None on a miss (or if the cache is unavailable)."""
+    try:
+        conn = _connect()
+        if conn is None:
+            return None
+        with closing(conn), conn:
+            row = conn.execute("SELECT response FROM llm_responses WHERE key = ?", (key,)).fetchone()
+    except sqlite3.Error as e:
+        logger.warning(f"LLM cache lookup failed, calling the model instead: {e}")
+        return None
+    if row is None:
+        return None
+    try:
+        return zlib.decompress(row[0]).decode("utf-8")
+    except (zlib.error, UnicodeDecodeError) as e:
+        # A corrupt entry is a miss; the next validated response overwrites it
+        logger.warning(f"Ignoring corrupt LLM cache entry: {e}")
+        return None
+
+def store_response(key: str, response_text: str) -> None:
+    """Cache a response. Only call this for responses that passed validation."""
+    try:
+        conn = _connect()
+        if conn is None:
+            return
+        with closing(conn), conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_responses (key, response, created_at) VALUES (?, ?, ?)",
+                (key, zlib.compress(response_text.encode("utf-8"), 6), int(time.time()))
+            )
+    except sqlite3.Error as e:
+        logger.warning(f"Failed to write LLM cache entry: {e}")
@@ -2,8 +2,11 @@
 
 import os
 import time
+import asyncio
+import random
 import logging
 import re
+from functools import lru_cache
 from typing import Optional
 
 from google import genai
@@ -16,10 +19,14 @@ GCP_LOCATION = "us-central1"
 # Retry settings
 LLM_MAX_RETRIES = 3
 LLM_INITIAL_BACKOFF = 5
+LLM_MAX_BACKOFF = 60  # Cap on a single retry sleep (seconds)
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Markdown code fences (```json / ```) wrapped around model output
+_CODE_FENCE_RE = re.compile(r'```(?:json)?\s*')
+
 # Initialize Gemini Client (singleton pattern)
 _client = None
 
@@ -39,8 +46,8 @@ def clean_json_response(response_text: str) -> str:
     response_text = response_text.strip()
     
     # Remove markdown code blocks
-    response_text = re.sub(r'```json\s*', '', response_text)
-    response_text = re.sub(r'```\s*', '', response_text)
+    if '```' in response_text:
+        response_text = _CODE_FENCE_RE.sub('', response_text)
     
     # Find the first { and last } to extract JSON
     first_brace = response_text.find('{')
@@ -61,6 +68,51 @@ def clean_json_response(response_text: str) -> str:
     # If no braces/brackets found, return original (will likely fail JSON parsing)
     return response_text
 
+# Permissive safety settings for financial data
+_SAFETY_SETTINGS = (
+    types.SafetySetting(category="HARM_CATEGORY_HATE_SPEECH", threshold="OFF"),
+    types.SafetySetting(category="HARM_CATEGORY_DANGEROUS_CONTENT", threshold="OFF"),
+    types.SafetySetting(category="HARM_CATEGORY_SEXUALLY_EXPLICIT", threshold="OFF"),
+    types.SafetySetting(category="HARM_CATEGORY_HARASSMENT", threshold="OFF"),
+)
+
+@lru_cache(maxsize=16)
+def _build_config(
+    use_json_mode: bool,
+    temperature: float,
+    max_tokens: int,
+    system_instruction: Optional[str] = None
+) -> types.GenerateContentConfig:
+    """Build (once per distinct argument set) the generation config. Shared across calls: do not mutate."""
+    return types.GenerateContentConfig(
+        response_mime_type="application/json" if use_json_mode else None,
+        temperature=temperature,
+        max_output_tokens=max_tokens,
+        safety_settings=list(_SAFETY_SETTINGS),
+        system_instruction=system_instruction or None,
+    )
+
+def _build_contents(prompt: str, context_text: Optional[str], pdf_bytes: Optional[bytes]) -> list:
+    """Assemble the single user turn: prompt, optional context, optional PDF."""
+    parts_list = [types.Part.from_text(text=prompt)]
+    if context_text:
+        parts_list.append(types.Part.from_text(text=context_text))
+    if pdf_bytes:
+        parts_list.append(types.Part.from_bytes(data=pdf_bytes, mime_type="application/pdf"))
+    return [types.Content(role="user", parts=parts_list)]
+
+def _response_text(response, use_json_mode: bool) -> str:
+    """Extract (and for JSON mode, clean) the text of a model response."""
+    if not response.text:
+        raise ValueError("LLM returned an empty response.")
+    if use_json_mode:
+        return clean_json_response(response.text)
+    return response.text.strip()
+
+def _retry_wait(attempt: int) -> float:
+    """Exponential backoff with full jitter so parallel callers don't retry in lockstep."""
+    return random.uniform(0, min(LLM_MAX_BACKOFF, LLM_INITIAL_BACKOFF * (2 ** attempt)))
+
 def call_gemini_with_retry(
     model_name: str, 
     prompt: str, 
@@ -68,7 +120,8 @@ def call_gemini_with_retry(
     pdf_bytes: Optional[bytes] = None,
     use_json_mode: bool = True,
     temperature: float = 0.0,
-    max_tokens: int = 16384
+    max_tokens: int = 16384,
+    system_instruction: Optional[str] = None
 ) -> str:
     """
     Call Gemini API with retry logic.
@@ -81,66 +134,60 @@ def call_gemini_with_retry(
         use_json_mode: Whether to use strict JSON mode
         temperature: Temperature for response generation
         max_tokens: Maximum tokens in response
+        system_instruction: Optional static instructions sent as the system instruction,
+            so the identical prefix can be reused by Vertex AI's implicit context caching
     
     Returns:
         The response text from the model
     """
     client = get_gemini_client()
+    config = _build_config(use_json_mode, temperature, max_tokens, system_instruction)
     
     for attempt in range(LLM_MAX_RETRIES):
         try:
-            # Build parts list
-            parts_list = []
-            
-            # Add prompt
-            parts_list.append(types.Part.from_text(text=prompt))
-            
-            # Add context if provided
-            if context_text:
-                parts_list.append(types.Part.from_text(text=context_text))
-            
-            # Add PDF if provided
-            if pdf_bytes:
-                parts_list.append(types.Part.from_bytes(data=pdf_bytes, mime_type="application/pdf"))
-            
-            contents = [types.Content(role="user", parts=parts_list)]
-            
-            # Configure generation
-            if use_json_mode:
-                config = types.GenerateContentConfig(
-                    response_mime_type="application/json",
-                    temperature=temperature,
-                    max_output_tokens=max_tokens,
-                )
-            else:
-                config = types.GenerateContentConfig(
-                    temperature=temperature,
-                    max_output_tokens=max_tokens
-                )
-            
-            # Add safety settings to be permissive for financial data
-            config.safety_settings = [
-                types.SafetySetting(category="HARM_CATEGORY_HATE_SPEECH", threshold="OFF"),
-                types.SafetySetting(category="HARM_CATEGORY_DANGEROUS_CONTENT", threshold="OFF"),
-                types.SafetySetting(category="HARM_CATEGORY_SEXUALLY_EXPLICIT", threshold="OFF"),
-                types.SafetySetting(category="HARM_CATEGORY_HARASSMENT", threshold="OFF"),
-            ]
-            
             # Make the API call
             response = client.models.generate_content(
                 model=model_name,
-                contents=contents,
+                contents=_build_contents(prompt, context_text, pdf_bytes),
                 config=config
             )
+            return _response_text(response, use_json_mode)
             
-            if not response.text:
-                raise ValueError("LLM returned an empty response.")
+        except Exception as e:
+            logger.warning(f"Gemini API call failed on attempt {attempt + 1}/{LLM_MAX_RETRIES}: {e}")
+            if attempt + 1 == LLM_MAX_RETRIES:
+                logger.error(f"All retry attempts failed for model {model_name}")
+                raise
             
-            # Clean response if using JSON mode
-            if use_json_mode:
-                return clean_json_response(response.text)
-            else:
-                return response.text.strip()
+            wait_time = _retry_wait(attempt)
+            logger.info(f"Waiting {wait_time:.1f} seconds before retry...")
+            time.sleep(wait_time)
+    
+    raise RuntimeError(f"LLM call to {model_name} failed after all retry attempts.")
+
+async def call_gemini_with_json_async(
+    model_name: str,
+    prompt: str,
+    context_text: Optional[str] = None,
+    temperature: float = 0.0,
+    max_tokens: int = 16384,
+    system_instruction: Optional[str] = None
+) -> str:
+    """
+    Async JSON-mode Gemini call (client.aio) with the same retry/backoff policy as
+    call_gemini_with_retry. Lets callers fan out many requests on one event loop.
+    """
+    client = get_gemini_client()
+    config = _build_config(True, temperature, max_tokens, system_instruction)
+    
+    for attempt in range(LLM_MAX_RETRIES):
+        try:
+            response = await client.aio.models.generate_content(
+                model=model_name,
+                contents=_build_contents(prompt, context_text, None),
+                config=config
+            )
+            return _response_text(response, True)
             
         except Exception as e:
             logger.warning(f"Gemini API call failed on attempt {attempt + 1}/{LLM_MAX_RETRIES}: {e}")
@@ -148,10 +195,9 @@ def call_gemini_with_retry(
                 logger.error(f"All retry attempts failed for model {model_name}")
                 raise
             
-            # Exponential backoff
-            wait_time = LLM_INITIAL_BACKOFF * (2 ** attempt)
-            logger.info(f"Waiting {wait_time} seconds before retry...")
-            time.sleep(wait_time)
+            wait_time = _retry_wait(attempt)
+            logger.info(f"Waiting {wait_time:.1f} seconds before retry...")
+            await asyncio.sleep(wait_time)
     
     raise RuntimeError(f"LLM call to {model_name} failed after all retry attempts.")
 
@@ -179,7 +225,8 @@ def call_gemini_with_json(
     prompt: str,
     context_text: Optional[str] = None,
     temperature: float = 0.0,
-    max_tokens: int = 16384
+    max_tokens: int = 16384,
+    system_instruction: Optional[str] = None
 ) -> str:
     """
     Convenience function for JSON-mode Gemini calls.
@@ -190,7 +237,8 @@ def call_gemini_with_json(
         context_text=context_text,
         use_json_mode=True,
         temperature=temperature,
-        max_tokens=max_tokens
+        max_tokens=max_tokens,
+        system_instruction=system_instruction
     )
 
 # For backward compatibility with existing PDF parser
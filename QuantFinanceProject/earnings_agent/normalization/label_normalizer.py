@@ -4,12 +4,17 @@ import logging
 import yaml
 from pathlib import Path
 import json
-from typing import Dict, Any, List, Set
+import re
+import sys
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from typing import Dict, Any, List, Set, Tuple
 
 from earnings_agent.storage.database import (
     get_session,
-    get_company_context,
-    get_label_mapping,
+    get_company_contexts,
+    get_label_mappings_bulk,
     upsert_label_mapping,
     get_docs_pending_label_normalization,
     get_docs_pending_label_review,
@@ -17,16 +22,40 @@ from earnings_agent.storage.database import (
 )
 from earnings_agent.storage.models import StagedNormalizedData
 from earnings_agent.llm.normalizer_client import call_gemini_with_json
-from sqlalchemy.orm.attributes import flag_modified
+from sqlalchemy import select, text
 
 # --- Configuration ---
 PLAYBOOKS_DIR = Path(__file__).resolve().parents[1] / "playbooks"
 # Portable path: works both locally and inside Docker (/app)
 PLAYBOOK_PATH = PLAYBOOKS_DIR / "sebi" / "metrics" / "sebi_banking.yml"
 LABEL_NORMALIZATION_MODEL = "gemini-2.5-pro"
+# Max raw labels per LLM call; larger prompts hit diminishing returns on latency
+LABEL_BATCH_SIZE = 200
+# Concurrent LLM calls; keep below the Vertex AI per-minute request quota
+LABEL_MAX_WORKERS = 16
+# Staged records fetched per server-side cursor round-trip
+STREAM_BATCH_SIZE = 500
+
+# Keyword heuristics for telling indirect from direct cash flow statements
+_CF_INDIRECT_RE = re.compile('|'.join(map(re.escape, [
+    'profit before', 'extraordinary', 'adjustments', 'working capital'
+])))
+_CF_DIRECT_RE = re.compile('|'.join(map(re.escape, [
+    'receipts from', 'payments to', 'operating activities - receipts'
+])))
+
+try:
+    _YAML_LOADER = yaml.CSafeLoader
+except AttributeError:  # PyYAML built without libyaml
+    _YAML_LOADER = yaml.SafeLoader
+
+LABEL_PATCH_SQL = """
+UPDATE earnings_data.staged_normalized_data
+SET normalized_data = jsonb_set(normalized_data, '{label_normalized_data}', CAST(:patch AS jsonb))
+WHERE doc_id = :doc_id
+"""
 
 # --- Logging Setup ---
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(module)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # --- LLM Prompt ---
@@ -71,56 +100,139 @@ class StatementPlaybookLoader:
         self.playbook_path = playbook_path
         self.statement_trees = self._load_all_statements(playbook_path)
         # Precompute leaves (exclude Abstract parents)
-        self.statement_leaves = {k: self._flatten_leaves(v) for k, v in self.statement_trees.items()}
+        self.statement_leaves = {k: tuple(self._flatten_leaves(v)) for k, v in self.statement_trees.items()}
+        # Pre-serialised leaves, spliced verbatim into every LLM payload for that statement
+        self.statement_leaves_json = {k: json.dumps(v) for k, v in self.statement_leaves.items()}
 
     def _load_all_statements(self, path: Path) -> dict:
         trees = {}
         try:
             with open(path, "r", encoding="utf-8") as f:
-                docs = list(yaml.safe_load_all(f))
+                # Stream documents one at a time rather than materialising the whole file
+                for doc in yaml.load_all(f, Loader=_YAML_LOADER):
+                    if isinstance(doc, dict) and doc.get("statement") and doc.get("nodes"):
+                        trees[doc["statement"]] = doc["nodes"]
         except Exception:
-            docs = []
-        for doc in docs:
-            if isinstance(doc, dict) and doc.get("statement") and doc.get("nodes"):
-                trees[doc["statement"]] = doc["nodes"]
+            pass
         return trees
 
     def _flatten_leaves(self, nodes):
+        # Iterative pre-order DFS (reversed pushes keep playbook order); no recursion-depth limit
         leaves = []
-        def rec(n):
-            has_children = bool(n.get("children"))
-            if has_children:
-                for ch in n["children"]:
-                    rec(ch)
+        stack = list(reversed(nodes))
+        while stack:
+            n = stack.pop()
+            children = n.get("children")
+            if children:
+                stack.extend(reversed(children))
             else:
                 leaves.append(n["id"])
-        for node in nodes:
-            rec(node)
         return leaves
 
-    def get_leaves_for(self, statement_key: str) -> list:
+    def get_leaves_for(self, statement_key: str) -> tuple:
         # statement_key expected: 'pnl', 'balance_sheet', 'cash_flow_indirect', 'cash_flow_direct'
-        return self.statement_leaves.get(statement_key, [])
+        return self.statement_leaves.get(statement_key, ())
+
+    def get_leaves_json_for(self, statement_key: str) -> str:
+        return self.statement_leaves_json.get(statement_key, "[]")
 
     def available_statements(self):
         return list(self.statement_trees.keys())
 
 
+# Playbooks are immutable for the life of a process; parse each one once.
+_PLAYBOOK_CACHE: Dict[Path, StatementPlaybookLoader] = {}
+
+
+def get_playbook_loader(playbook_path: Path) -> StatementPlaybookLoader:
+    """Return the cached StatementPlaybookLoader for a playbook, loading it on first use."""
+    loader = _PLAYBOOK_CACHE.get(playbook_path)
+    if loader is None:
+        loader = StatementPlaybookLoader(playbook_path)
+        _PLAYBOOK_CACHE[playbook_path] = loader
+    return loader
+
+
+def _resolve_statement_key(std_map: str, figures: List[Dict[str, Any]]) -> str | None:
+    """Map a statement's standard_mapping to its playbook statement key (None if unknown)."""
+    std_lower = std_map.lower()
+    if 'pnl' in std_lower or 'income' in std_lower:
+        return 'pnl'
+    if 'balance' in std_lower:
+        return 'balance_sheet'
+    if 'cash' in std_lower:
+        # Heuristic to choose indirect vs direct
+        labels_text = " ".join((f.get('label') or '').lower() for f in figures)
+        if _CF_INDIRECT_RE.search(labels_text):
+            return 'cash_flow_indirect'
+        if _CF_DIRECT_RE.search(labels_text):
+            return 'cash_flow_direct'
+        return 'cash_flow_indirect'  # default for Indian banks
+    return None
+
+
+def _tickers_for_docs(session, doc_ids: List[int]) -> Set[str]:
+    """Distinct tickers for a set of staged docs, without loading their JSON payloads."""
+    return set(session.execute(
+        select(StagedNormalizedData.ticker).where(StagedNormalizedData.doc_id.in_(doc_ids)).distinct()
+    ).scalars())
+
+
+def _stream_staged_records(session, doc_ids: List[int]):
+    """
+    Yield StagedNormalizedData rows for doc_ids in doc_id order, fetched through a
+    server-side cursor STREAM_BATCH_SIZE rows at a time so the (large) normalized_data
+    payloads are never all held in memory at once.
+    """
+    stmt = (
+        select(StagedNormalizedData)
+        .where(StagedNormalizedData.doc_id.in_(doc_ids))
+        .order_by(StagedNormalizedData.doc_id)
+        .execution_options(yield_per=STREAM_BATCH_SIZE)
+    )
+    yield from session.execute(stmt).scalars()
+
+
+def _request_label_mappings(task: Tuple[str, str, str]) -> Dict[str, Any] | None:
+    """Run one label-mapping LLM call (thread-pool worker). Returns None on failure."""
+    industry, stmt_key, context_payload = task
+    try:
+        # Static instructions go in the system instruction so the shared prefix is cacheable
+        response_text = call_gemini_with_json(
+            model_name=LABEL_NORMALIZATION_MODEL,
+            prompt=context_payload,
+            system_instruction=LABEL_NORMALIZATION_PROMPT
+        )
+        return json.loads(response_text)
+    except Exception as e:
+        logger.error(f"LLM call failed for {industry} / {stmt_key}: {e}")
+        return None
+
+
 def run_label_normalizer_discovery(allow_llm: bool = True):
 
     """Find new, unmapped labels per statement, get LLM suggestions, and populate the cache for human review.
        CHANGE: now runs **statement-by-statement** using the nested playbook for Banking (ELRs 100200/100300/100600/100700).
+       Labels are first collected across all pending docs per (industry, statement_key), then sent to the
+       LLM in batches of at most LABEL_BATCH_SIZE instead of one call per (doc, statement).
     """
     logger.info("=== Starting Label Normalizer Discovery Phase (Statement-batched) ===")
     session = get_session()
-    from sqlalchemy import select
-    from earnings_agent.storage.models import StagedNormalizedData
     try:
         playbook_path = PLAYBOOK_PATH
-        sp_loader = StatementPlaybookLoader(playbook_path)
+        sp_loader = get_playbook_loader(playbook_path)
 
         docs_to_update_status = []
-        processed_in_this_run = set()
+        processed_in_this_run: Set[Tuple[str, str]] = set()
+        # industry -> {raw_label: LabelMapping}, fetched once per industry
+        industry_mappings: Dict[str, Dict[str, Any]] = {}
+        # (industry, stmt_key, statement_name, statement_currency) -> new raw labels across all docs,
+        # plus where each label was first seen. Name and currency stay in the key so every batch
+        # carries the same statement context the per-statement prompt had.
+        # A label is queued under the first statement it is seen in: the cache is keyed on
+        # (raw_label, industry), so asking about it again for another statement only burns tokens.
+        pending_by_stmt: Dict[Tuple[str, str, Any, Any], Set[str]] = defaultdict(set)
+        label_sources: Dict[Tuple[str, str], Dict[str, Any]] = {}
 
         doc_ids = get_docs_pending_label_normalization()
         if not doc_ids:
@@ -128,11 +240,13 @@ def run_label_normalizer_discovery(allow_llm: bool = True):
             return
 
         logger.info(f"Found {len(doc_ids)} documents to process for label discovery.")
-        for doc_id in doc_ids:
-            record = session.execute(select(StagedNormalizedData).where(StagedNormalizedData.doc_id==doc_id)).scalar_one_or_none()
-            if not record:
-                continue
-            company_context = get_company_context(session, record.ticker)
+
+        contexts = get_company_contexts(session, _tickers_for_docs(session, doc_ids))
+
+        # --- Collection phase: walk every doc and gather the new labels per statement ---
+        for record in _stream_staged_records(session, doc_ids):
+            doc_id = record.doc_id
+            company_context = contexts.get(record.ticker)
             if not company_context:
                 logger.warning(f"Skipping doc_id {doc_id} ({record.ticker}): No company context found.")
                 continue
@@ -144,6 +258,12 @@ def run_label_normalizer_discovery(allow_llm: bool = True):
                     f"Skipping doc_id {doc_id}: industry '{industry}' has no playbook."
                 )
                 continue
+            # Interned: used in every (label, industry) / (industry, stmt_key) key below
+            industry = sys.intern(industry)
+            if industry not in industry_mappings:
+                industry_mappings[industry] = get_label_mappings_bulk(industry)
+            known_labels = industry_mappings[industry]
+
             unit_data = record.normalized_data.get('unit_normalized_data', {}).get('llm_unit_analysis', {})
             stmt_analyses = unit_data.get('statement_analyses', [])
 
@@ -158,79 +278,73 @@ def run_label_normalizer_discovery(allow_llm: bool = True):
                     continue
 
                 # Map standard_mapping to playbook statement key
-                std_lower = std_map.lower()
-                if 'pnl' in std_lower or 'income' in std_lower:
-                    stmt_key = 'pnl'
-                elif 'balance' in std_lower:
-                    stmt_key = 'balance_sheet'
-                elif 'cash' in std_lower:
-                    # Heuristic to choose indirect vs direct
-                    labels_text = " ".join((f.get('label') or '').lower() for f in figures)
-                    if any(k in labels_text for k in ['profit before', 'extraordinary', 'adjustments', 'working capital']):
-                        stmt_key = 'cash_flow_indirect'
-                    elif any(k in labels_text for k in ['receipts from', 'payments to', 'operating activities - receipts']):
-                        stmt_key = 'cash_flow_direct'
-                    else:
-                        stmt_key = 'cash_flow_indirect'  # default for Indian banks
-                else:
+                stmt_key = _resolve_statement_key(std_map, figures)
+                if stmt_key is None:
                     # Unknown statement, skip
                     logger.info(f"Unknown statement mapping '{std_map}' for doc_id {doc_id}; skipping batch.")
                     continue
 
-                standard_names = sp_loader.get_leaves_for(stmt_key)
-                if not standard_names:
+                if not sp_loader.get_leaves_for(stmt_key):
                     logger.warning(f"No playbook leaves found for statement '{stmt_key}'.")
                     continue
 
-                raw_labels_this_stmt = list({(fig.get('label') or '').strip() for fig in figures if fig.get('label')})
+                raw_labels_this_stmt = {(fig.get('label') or '').strip() for fig in figures if fig.get('label')}
+                stmt_group = (industry, stmt_key, sa.get('statement_type'), sa.get('statement_currency'))
 
                 # Determine which labels are new relative to cache
-                new_labels_to_process = []
                 for label in raw_labels_this_stmt:
-                    if (label, industry) not in processed_in_this_run and not get_label_mapping(label, industry):
-                        new_labels_to_process.append(label)
-
-                if not new_labels_to_process:
-                    continue
-
-                if allow_llm:
-                    logger.info(f"[doc {doc_id}] {record.ticker} | {std_map} | batching {len(new_labels_to_process)} new labels")
-                    context_payload = json.dumps({
-                        "industry": industry,
-                        "statement_key": stmt_key,
-                        "statement_name": sa.get('statement_type'),
-                        "statement_currency": sa.get('statement_currency'),
-                        "standard_names": standard_names,
-                        "raw_labels": new_labels_to_process
-                    })
-
-                    try:
-                        response_text = call_gemini_with_json(
-                            model_name=LABEL_NORMALIZATION_MODEL,
-                            prompt=LABEL_NORMALIZATION_PROMPT,
-                            context_text=context_payload
-                        )
-                        llm_mappings = json.loads(response_text)
-
-                        for label, mapped_label in llm_mappings.items():
-                            upsert_label_mapping({
-                                "raw_label": label,
-                                "industry": industry,
-                                "normalized_label": mapped_label,
-                                "status": 'PENDING_REVIEW',
-                                "source_context": {
-                                    'doc_id': doc_id,
-                                    'ticker': record.ticker,
-                                    'statement_key': stmt_key,
-                                    'standard_mapping': std_map
-                                }
-                            })
-                            processed_in_this_run.add((label, industry))
-                    except Exception as e:
-                        logger.error(f"LLM call failed for doc_id {doc_id} / {std_map}: {e}")
+                    if label in known_labels or (industry, label) in label_sources:
+                        continue
+                    pending_by_stmt[stmt_group].add(label)
+                    label_sources[(industry, label)] = {
+                        'doc_id': doc_id,
+                        'ticker': record.ticker,
+                        'statement_key': stmt_key,
+                        'standard_mapping': std_map
+                    }
 
             docs_to_update_status.append(doc_id)
 
+        # --- LLM phase: one call per (industry, statement_key) batch, fanned out over a thread pool ---
+        if allow_llm:
+            tasks, task_labels = [], []
+            for (industry, stmt_key, stmt_name, stmt_currency), labels in pending_by_stmt.items():
+                # Same JSON as json.dumps({...}) but the standard_names list is serialised once per statement
+                payload_head = (
+                    f'{{"industry": {json.dumps(industry)}, "statement_key": {json.dumps(stmt_key)}, '
+                    f'"statement_name": {json.dumps(stmt_name)}, "statement_currency": {json.dumps(stmt_currency)}, '
+                    f'"standard_names": {sp_loader.get_leaves_json_for(stmt_key)}, "raw_labels": '
+                )
+                sorted_labels = sorted(labels)
+                for i in range(0, len(sorted_labels), LABEL_BATCH_SIZE):
+                    batch = sorted_labels[i:i + LABEL_BATCH_SIZE]
+                    logger.info(f"{industry} | {stmt_key} | batching {len(batch)} new labels")
+                    context_payload = payload_head + json.dumps(batch) + "}"
+                    tasks.append((industry, stmt_key, context_payload))
+                    task_labels.append(set(batch))
+
+            # Only the LLM calls run in worker threads; DB writes stay on this thread
+            with ThreadPoolExecutor(max_workers=LABEL_MAX_WORKERS) as executor:
+                results = executor.map(_request_label_mappings, tasks)
+
+                for (industry, stmt_key, _), requested, llm_mappings in zip(tasks, task_labels, results):
+                    if llm_mappings is None:
+                        continue
+                    for label, mapped_label in llm_mappings.items():
+                        if label not in requested:
+                            logger.warning(f"Ignoring label '{label}' returned by the LLM for {industry} / {stmt_key}: not in the request.")
+                            continue
+                        if (label, industry) in processed_in_this_run:
+                            continue
+                        upsert_label_mapping({
+                            "raw_label": label,
+                            "industry": industry,
+                            "normalized_label": mapped_label,
+                            "status": 'PENDING_REVIEW',
+                            "source_context": label_sources.get((industry, label))
+                        })
+                        processed_in_this_run.add((label, industry))
+
         if docs_to_update_status:
             mark_docs_label_review_status(docs_to_update_status, 'PENDING_REVIEW')
             logger.info(f"Marked {len(docs_to_update_status)} documents as PENDING_REVIEW.")
@@ -244,8 +358,6 @@ def run_label_normalizer_application():
     """Finds documents where all labels are approved and creates the final normalized data structure."""
     logger.info("=== Starting Label Normalizer Application Phase ===")
     session = get_session()
-    from sqlalchemy import select
-    from earnings_agent.storage.models import StagedNormalizedData
     try:
         doc_ids = get_docs_pending_label_review()
         if not doc_ids:
@@ -254,51 +366,60 @@ def run_label_normalizer_application():
 
         logger.info(f"Found {len(doc_ids)} documents to check for application.")
         successful_doc_ids = []
+        label_updates: List[Dict[str, Any]] = []
+        # industry -> {raw_label: normalized_label} for APPROVED mappings, built once per industry
+        industry_approved: Dict[str, Dict[str, Any]] = {}
 
-        for doc_id in doc_ids:
-            record = session.query(StagedNormalizedData).filter_by(doc_id=doc_id).one()
-            company_context = get_company_context(session, record.ticker)
+        contexts = get_company_contexts(session, _tickers_for_docs(session, doc_ids))
+
+        for record in _stream_staged_records(session, doc_ids):
+            doc_id = record.doc_id
+            company_context = contexts[record.ticker]
             industry = company_context.classification.industry_name
+            if industry not in industry_approved:
+                industry_approved[industry] = {
+                    label: m.normalized_label
+                    for label, m in get_label_mappings_bulk(industry).items()
+                    if m.status == 'APPROVED'
+                }
+            approved = industry_approved[industry]
             
-            unit_data = record.normalized_data.get('unit_normalized_data', {}).get('llm_unit_analysis', {})
-            all_raw_labels = {fig['label'] for stmt in unit_data.get('statement_analyses', []) for fig in stmt['figures']}
+            normalized_data = record.normalized_data
+            unit_data = normalized_data.get('unit_normalized_data', {}).get('llm_unit_analysis', {})
+            stmt_analyses = unit_data.get('statement_analyses', ())
+            all_raw_labels = {fig['label'] for stmt in stmt_analyses for fig in stmt.get('figures', ())}
             
             # Critical Check: Are all labels for this document approved?
-            approved_mappings = {}
-            all_approved = True
-            for label in all_raw_labels:
-                mapping = get_label_mapping(label, industry)
-                if mapping and mapping.status == 'APPROVED':
-                    approved_mappings[label] = mapping.normalized_label
-                else:
-                    all_approved = False
-                    break # No need to check further
-
-            if not all_approved:
+            if not all_raw_labels <= approved.keys():
                 continue # Skip to the next document
+            approved_mappings = {label: approved[label] for label in all_raw_labels}
 
             # --- If all approved, build the final structure ---
             logger.info(f"All labels approved for doc_id {doc_id}. Applying normalization...")
             
             # Build a lookup for original figures to fetch the 'suspect' flag
-            original_figures = {}
-            stmt_norm_data = record.normalized_data.get('statement_normalized_data', {})
-            for scope in ['standalone', 'consolidated']:
-                for stmt_type, stmt_content in stmt_norm_data.get(scope, {}).items():
-                    if isinstance(stmt_content, dict):
-                        for fig in stmt_content.get('figures', []):
-                            original_figures[fig['label']] = fig
+            stmt_norm_data = normalized_data.get('statement_normalized_data', {})
+            original_figures = {
+                fig['label']: fig
+                for fig in chain.from_iterable(
+                    stmt_content.get('figures', ())
+                    for scope in ('standalone', 'consolidated')
+                    for stmt_content in stmt_norm_data.get(scope, {}).values()
+                    if isinstance(stmt_content, dict)
+                )
+            }
             
             final_data = {'standalone': {}, 'consolidated': {}}
-            for stmt in unit_data.get('statement_analyses', []):
+            for stmt in stmt_analyses:
                 scope = 'standalone' if 'standalone' in stmt['standard_mapping'] else 'consolidated'
-                for fig in stmt['figures']:
+                scope_data = final_data[scope]
+                for fig in stmt.get('figures', ()):
                     raw_label = fig['label']
                     normalized_label = approved_mappings.get(raw_label)
                     
                     if normalized_label: # Only include mapped labels
                         original_fig = original_figures.get(raw_label, {})
-                        final_data[scope][normalized_label] = {
+                        scope_data[normalized_label] = {
                             "value": fig['value'],
                             "representation": fig.get('representation'),
                             "currency_context": fig.get('currency_context'),
@@ -306,11 +427,13 @@ def run_label_normalizer_application():
                             "suspect_reason": original_fig.get('suspect_reason')
                         }
             
-            record.normalized_data['label_normalized_data'] = final_data
-            flag_modified(record, 'normalized_data')
+            label_updates.append({'doc_id': doc_id, 'patch': json.dumps(final_data)})
             successful_doc_ids.append(doc_id)
 
         if successful_doc_ids:
+            # Patch only the label_normalized_data key server-side (executemany) instead of
+            # re-serialising and rewriting each full normalized_data document from Python.
+            session.execute(text(LABEL_PATCH_SQL), label_updates)
             session.commit()
             mark_docs_label_review_status(successful_doc_ids, 'APPROVED')
             logger.info(f"Successfully applied label normalization for {len(successful_doc_ids)} documents.")
@@ -2,6 +2,7 @@
 
 import logging
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # Add project root to path
@@ -27,9 +28,15 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def main(allow_llm: bool = True):
+def main(allow_llm: bool = True, sequential: bool = False):
     """
     Main orchestration function for the full normalization pipeline.
+
+    Unless `sequential` is set, label application for documents already queued for
+    label review runs on a worker thread while unit discovery waits on the LLM. The two
+    touch disjoint documents (label_review_status='PENDING_REVIEW' vs
+    unit_review_status='PENDING'). Label application still runs again after label
+    discovery, so documents discovered in this run are applied in this run as before.
     """
     logger.info("=" * 80)
     logger.info("STARTING FULL NORMALIZATION WORKFLOW - PHASE 1, 2 & 3")
@@ -44,7 +51,13 @@ def main(allow_llm: bool = True):
         
         # PHASE 2: Unit Normalization
         logger.info("🔄 PHASE 2: Unit Normalization")
-        run_unit_normalizer_discovery(allow_llm)
+        if sequential:
+            run_unit_normalizer_discovery(allow_llm)
+        else:
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                label_apply_future = executor.submit(run_label_normalizer_application)
+                run_unit_normalizer_discovery(allow_llm)
+                label_apply_future.result()
         run_unit_normalizer_application()
         logger.info("✅ Phase 2 Complete - Unit normalization finished")
 
@@ -63,13 +76,39 @@ def main(allow_llm: bool = True):
     logger.info("NORMALIZATION WORKFLOW COMPLETE")
     logger.info("=" * 80)
 
+STATUS_REPORT_SQL = """
+WITH parsed AS (
+    SELECT count(*) AS n FROM earnings_data.parsed_documents WHERE parse_status = 'PARSED_OK'
+), stmt AS (
+    SELECT count(*) AS n FROM earnings_data.staged_normalized_data WHERE statement_normalized
+), unit AS (
+    SELECT unit_review_status AS status, count(*) AS n
+    FROM earnings_data.staged_normalized_data GROUP BY 1
+), label AS (
+    SELECT label_review_status AS status, count(*) AS n
+    FROM earnings_data.staged_normalized_data GROUP BY 1
+), unit_queue AS (
+    SELECT status, count(*) AS n FROM earnings_data.unit_review_queue GROUP BY 1
+), label_cache AS (
+    SELECT status, count(*) AS n FROM earnings_data.label_mapping_cache GROUP BY 1
+)
+SELECT json_build_object(
+    'parsed',      (SELECT n FROM parsed),
+    'stmt',        (SELECT n FROM stmt),
+    'unit',        (SELECT COALESCE(json_object_agg(status, n), '{}'::json) FROM unit),
+    'label',       (SELECT COALESCE(json_object_agg(status, n), '{}'::json) FROM label),
+    'unit_queue',  (SELECT COALESCE(json_object_agg(status, n), '{}'::json) FROM unit_queue),
+    'label_cache', (SELECT COALESCE(json_object_agg(status, n), '{}'::json) FROM label_cache)
+)
+"""
+
 def status_report():
     """
     Generate a comprehensive status report of the entire normalization pipeline.
+    All counts come from a single round-trip (see STATUS_REPORT_SQL).
     """
     from earnings_agent.storage.database import get_session
-    from sqlalchemy import select, func
-    from earnings_agent.storage.models import StagedNormalizedData, UnitReviewQueue, ParsedDocument, LabelMapping
+    from sqlalchemy import text
     
     logger.info("=" * 60)
     logger.info("📊 NORMALIZATION PIPELINE STATUS REPORT")
@@ -77,64 +116,38 @@ def status_report():
     
     session = get_session()
     try:
-        total_parsed = session.execute(
-            select(func.count(ParsedDocument.doc_id)).where(ParsedDocument.parse_status == 'PARSED_OK')
-        ).scalar()
-        logger.info(f"📄 Total Parsed Documents: {total_parsed}")
-        
-        # Statement normalization status
-        stmt_complete = session.execute(
-            select(func.count(StagedNormalizedData.id)).where(StagedNormalizedData.statement_normalized == True)
-        ).scalar()
-        logger.info(f"📋 Statement Normalization: {stmt_complete}/{total_parsed} Complete")
-
-        # Unit normalization status
-        unit_statuses = session.execute(
-            select(StagedNormalizedData.unit_review_status, func.count(StagedNormalizedData.id))
-            .group_by(StagedNormalizedData.unit_review_status)
-        ).all()
-        logger.info("🔬 Unit Normalization:")
-        for status, count in unit_statuses:
-            logger.info(f"   - {status}: {count}")
-
-        # --- NEW: Label normalization status ---
-        label_statuses = session.execute(
-            select(StagedNormalizedData.label_review_status, func.count(StagedNormalizedData.id))
-            .group_by(StagedNormalizedData.label_review_status)
-        ).all()
-        logger.info("🏷️ Label Normalization:")
-        for status, count in label_statuses:
-            logger.info(f"   - {status}: {count}")
-        # -----------------------------------------
-
-        # Unit review queue status
-        unit_queue_statuses = session.execute(
-            select(UnitReviewQueue.status, func.count(UnitReviewQueue.id))
-            .group_by(UnitReviewQueue.status)
-        ).all()
-        logger.info("📋 Unit Review Queue:")
-        for status, count in unit_queue_statuses:
-            logger.info(f"   - {status}: {count}")
-
-        # --- NEW: Label mapping cache status ---
-        label_cache_statuses = session.execute(
-            select(LabelMapping.status, func.count(LabelMapping.raw_label))
-            .group_by(LabelMapping.status)
-        ).all()
-        logger.info("🧠 Label Mapping Cache:")
-        for status, count in label_cache_statuses:
-            logger.info(f"   - {status}: {count}")
-        # -----------------------------------------
-
-        fully_normalized = session.execute(
-            select(func.count(StagedNormalizedData.id))
-            .where(StagedNormalizedData.label_review_status == 'APPROVED')
-        ).scalar()
-        
-        logger.info(f"🏆 Fully Normalized & Ready for Quality Engine: {fully_normalized} filings")
-        
+        report = session.execute(text(STATUS_REPORT_SQL)).scalar()
     finally:
         session.close()
+
+    total_parsed = report['parsed']
+    logger.info(f"📄 Total Parsed Documents: {total_parsed}")
+
+    # Statement normalization status
+    logger.info(f"📋 Statement Normalization: {report['stmt']}/{total_parsed} Complete")
+
+    # Unit normalization status
+    logger.info("🔬 Unit Normalization:")
+    for status, count in report['unit'].items():
+        logger.info(f"   - {status}: {count}")
+
+    # Label normalization status
+    logger.info("🏷️ Label Normalization:")
+    for status, count in report['label'].items():
+        logger.info(f"   - {status}: {count}")
+
+    # Unit review queue status
+    logger.info("📋 Unit Review Queue:")
+    for status, count in report['unit_queue'].items():
+        logger.info(f"   - {status}: {count}")
+
+    # Label mapping cache status
+    logger.info("🧠 Label Mapping Cache:")
+    for status, count in report['label_cache'].items():
+        logger.info(f"   - {status}: {count}")
+
+    fully_normalized = report['label'].get('APPROVED', 0)
+    logger.info(f"🏆 Fully Normalized & Ready for Quality Engine: {fully_normalized} filings")
     
     logger.info("=" * 60)
 
@@ -144,13 +157,14 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Full Normalization Engine')
     parser.add_argument('--no-llm', action='store_true', help='Disable all LLM calls')
     parser.add_argument('--status', action='store_true', help='Show detailed pipeline status report')
+    parser.add_argument('--sequential', action='store_true', help='Run every phase step serially (debugging)')
     args = parser.parse_args()
     
     try:
         if args.status:
             status_report()
         else:
-            main(allow_llm=not args.no_llm)
+            main(allow_llm=not args.no_llm, sequential=args.sequential)
             logger.info("\n" + "="*40 + " FINAL STATUS " + "="*40)
             status_report()
             
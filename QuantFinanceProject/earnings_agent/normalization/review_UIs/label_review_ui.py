@@ -18,7 +18,10 @@ try:
     from earnings_agent.storage.database import (
         get_session,
         fetch_pending_label_reviews,
-        update_label_mapping_status
+        fetch_first_figure_contexts,
+        get_label_source_contexts,
+        update_label_mapping_status,
+        bulk_update_label_mapping_status
     )
     from earnings_agent.storage.models import LabelMapping
 except ImportError as e:
@@ -33,27 +36,26 @@ def find_first_figure_context(session, raw_label: str) -> dict:
     Finds the first occurrence of a raw_label in the staged data and returns its context.
     This is an expensive query and should be used with caching.
     """
-    # This raw SQL query finds the first document that contains the raw_label
-    # and unnests its JSON to find the matching figure's details.
+    # Finds the first document that contains the raw_label (the @> predicate can use the
+    # GIN index on statement_analyses) and pulls the matching figure out with a single
+    # SQL/JSON path traversal that stops at the first hit, instead of unnesting
+    # statement_analyses and figures into intermediate rowsets.
     sql = """
-    WITH first_doc AS (
-        SELECT doc_id, normalized_data
-        FROM earnings_data.staged_normalized_data
-        WHERE
-            normalized_data -> 'unit_normalized_data' -> 'llm_unit_analysis' -> 'statement_analyses' @> :label_json
-        ORDER BY doc_id
-        LIMIT 1
-    )
     SELECT
         (figure ->> 'value')::numeric AS value,
         figure ->> 'representation' AS representation,
         figure ->> 'currency_context' AS currency_context
     FROM
-        first_doc,
-        jsonb_to_recordset(first_doc.normalized_data -> 'unit_normalized_data' -> 'llm_unit_analysis' -> 'statement_analyses') AS analysis(figures JSONB),
-        jsonb_array_elements(analysis.figures) AS figure
+        earnings_data.staged_normalized_data s,
+        jsonb_path_query_first(
+            s.normalized_data,
+            '$.unit_normalized_data.llm_unit_analysis.statement_analyses[*].figures[*] ? (@.label == $lbl)',
+            jsonb_build_object('lbl', CAST(:raw_label AS text))
+        ) AS figure
     WHERE
-        figure ->> 'label' = :raw_label
+        s.normalized_data -> 'unit_normalized_data' -> 'llm_unit_analysis' -> 'statement_analyses' @> CAST(:label_json AS jsonb)
+        AND figure IS NOT NULL
+    ORDER BY s.doc_id
     LIMIT 1;
     """
     
@@ -73,8 +75,50 @@ def find_first_figure_context(session, raw_label: str) -> dict:
     return {}
 
 
+@st.cache_resource
+def _context_cache() -> dict:
+    """
+    Process-wide {raw_label: context} memo table. A plain dict held by cache_resource,
+    so hits are dict probes with no pickling (unlike st.cache_data).
+    """
+    return {}
+
+
+def prefetch_contexts(raw_labels) -> None:
+    """Fills the context cache for any of `raw_labels` not yet cached, in one query."""
+    cache = _context_cache()
+    missing = [label for label in set(raw_labels) if label not in cache]
+    if missing:
+        with st.spinner("Fetching context..."):
+            cache.update(fetch_first_figure_contexts(missing))
+
+
+def get_cached_context(raw_label: str) -> dict:
+    """
+    Returns the example context for a label; labels the batched fetch didn't find
+    fall back to a single-label lookup, and the result (even empty) is memoised.
+    """
+    cache = _context_cache()
+    if raw_label not in cache:
+        # Short-lived session: the connection goes back to the pool as soon as the lookup returns
+        with get_session() as session:
+            cache[raw_label] = find_first_figure_context(session, raw_label)
+    return cache[raw_label]
+
+
+def remove_from_queue(*items):
+    """Drops reviewed items from the session's cached queue so the rerun doesn't refetch them."""
+    reviewed = {(item.raw_label, item.industry) for item in items}
+    st.session_state.pending_reviews = [
+        r for r in st.session_state.pending_reviews
+        if (r.raw_label, r.industry) not in reviewed
+    ]
+
+
 # --- 3. Main Streamlit Application ---
 
+PAGE_SIZE = 25  # Review rows rendered per page
+
 # Page configuration
 st.set_page_config(
     layout="wide",
@@ -85,91 +129,133 @@ st.set_page_config(
 st.title("🏷️ Label Normalization Review")
 st.caption("Review and approve LLM-suggested mappings. Your approvals create the ground truth for the system.")
 
-# Fetch all pending reviews
-try:
-    db_session = get_session()
-    pending_reviews = fetch_pending_label_reviews()
-
-    if not pending_reviews:
-        st.success("🎉 No pending label reviews found! The queue is clear.")
-        st.balloons()
-        st.stop()
-
-    st.info(f"Found **{len(pending_reviews)}** unique labels pending review.")
-
-    # Display header for the columns
-    col1, col2, col3, col4 = st.columns([3, 2, 2, 2])
-    col1.markdown("**Raw Label from Document**")
-    col2.markdown("**Example Context**")
-    col3.markdown("**Editable Mapping**")
-    col4.markdown("**Actions**")
-    st.markdown("---")
+# Fetch all pending reviews once per browser session; approve/reject remove items locally
+if st.sidebar.button("🔄 Refresh queue"):
+    st.session_state.pop('pending_reviews', None)
+if 'pending_reviews' not in st.session_state:
+    st.session_state.pending_reviews = fetch_pending_label_reviews()
+pending_reviews = st.session_state.pending_reviews
+
+if not pending_reviews:
+    st.success("🎉 No pending label reviews found! The queue is clear.")
+    st.balloons()
+    st.stop()
+
+st.info(f"Found **{len(pending_reviews)}** unique labels pending review.")
+
+# Only render one page of rows; widget count (and context lookups) stay O(PAGE_SIZE)
+num_pages = (len(pending_reviews) + PAGE_SIZE - 1) // PAGE_SIZE
+page = st.number_input("Page", min_value=1, max_value=num_pages, value=1, step=1) if num_pages > 1 else 1
+page_items = pending_reviews[(page - 1) * PAGE_SIZE : page * PAGE_SIZE]
+
+# Fetch example contexts for the visible labels in one query (cached for the process)
+prefetch_contexts(item.raw_label for item in page_items)
+
+# Source contexts are not loaded with the queue; fetch them for the visible rows only
+source_contexts = st.session_state.setdefault('source_contexts', {})
+missing_keys = [(item.raw_label, item.industry) for item in page_items
+                if (item.raw_label, item.industry) not in source_contexts]
+if missing_keys:
+    fetched_sources = get_label_source_contexts(missing_keys)
+    for key in missing_keys:
+        source_contexts[key] = fetched_sources.get(key)
+
+# Bulk approval: one batched UPDATE/commit for every ticked row on this page.
+# Checkbox and mapping values are read from session_state, as set on the previous run.
+if st.button("✅ Approve Selected", type="primary"):
+    selected = [
+        item for item in page_items
+        if st.session_state.get(f"sel_map_{item.raw_label}_{item.industry}")
+    ]
+    if not selected:
+        st.warning("No rows selected.")
+    else:
+        try:
+            bulk_update_label_mapping_status(
+                [
+                    (
+                        item.raw_label,
+                        item.industry,
+                        st.session_state.get(f"map_{item.raw_label}_{item.industry}", item.normalized_label or "")
+                    )
+                    for item in selected
+                ],
+                "APPROVED"
+            )
+            remove_from_queue(*selected)
+            st.toast(f"Approved {len(selected)} mappings", icon="✅")
+            st.rerun()
+        except Exception as e:
+            st.error(f"Failed to approve selected mappings: {e}")
 
-    # Iterate through pending items and display them
-    for item in pending_reviews:
-        with st.container():
-            col1, col2, col3, col4 = st.columns([3, 2, 2, 2])
-
-            with col1:
-                st.markdown(f"`{item.raw_label}`")
-                with st.expander("Show Source Context"):
-                    st.json(item.source_context)
-
-            with col2:
-                # Use caching to avoid re-querying the DB on every UI interaction
-                @st.cache_data(show_spinner="Fetching context...")
-                def get_cached_context(label, industry):
-                    # Create a new session within the cached function for thread safety
-                    session = get_session()
-                    try:
-                        return find_first_figure_context(session, label)
-                    finally:
-                        session.close()
-
-                context = get_cached_context(item.raw_label, item.industry)
-
-                value = context.get('value')
-                representation = context.get('representation', 'N/A')
-                currency = context.get('currency_context', '')
-
-                if value is None:
-                    st.warning("Value: null")
-                else:
-                    # Display industry in the metric label for context
-                    st.metric(label=f"{item.industry} ({currency})", value=f"{value:,}")
-                st.caption(f"Rep: {representation}")
-
-            with col3:
-                unique_key = f"map_{item.raw_label}_{item.industry}"
-                # Handle None from DB for the text input
-                current_suggestion = item.normalized_label or "" 
-                edited_label = st.text_input(
-                    "Suggested Mapping",
-                    value=current_suggestion,
-                    key=unique_key,
-                    label_visibility="collapsed"
-                )
-            
-            with col4:
-                approve_key = f"approve_{unique_key}"
-                if st.button("✅ Approve", key=approve_key, use_container_width=True):
-                    try:
-                        update_label_mapping_status(item.raw_label, item.industry, "APPROVED", new_label=edited_label)
+# Display header for the columns
+col1, col2, col3, col4 = st.columns([3, 2, 2, 2])
+col1.markdown("**Raw Label from Document**")
+col2.markdown("**Example Context**")
+col3.markdown("**Editable Mapping**")
+col4.markdown("**Actions**")
+st.markdown("---")
+
+# Iterate through this page's pending items and display them
+for item in page_items:
+    with st.container():
+        col1, col2, col3, col4 = st.columns([3, 2, 2, 2])
+
+        with col1:
+            st.markdown(f"`{item.raw_label}`")
+            with st.expander("Show Source Context"):
+                st.json(source_contexts.get((item.raw_label, item.industry)))
+
+        with col2:
+            context = get_cached_context(item.raw_label)
+
+            value = context.get('value')
+            representation = context.get('representation', 'N/A')
+            currency = context.get('currency_context', '')
+
+            if value is None:
+                st.warning("Value: null")
+            else:
+                # Display industry in the metric label for context
+                st.metric(label=f"{item.industry} ({currency})", value=f"{value:,}")
+            st.caption(f"Rep: {representation}")
+
+        with col3:
+            unique_key = f"map_{item.raw_label}_{item.industry}"
+            # Handle None from DB for the text input
+            current_suggestion = item.normalized_label or "" 
+            edited_label = st.text_input(
+                "Suggested Mapping",
+                value=current_suggestion,
+                key=unique_key,
+                label_visibility="collapsed"
+            )
+        
+        with col4:
+            st.checkbox("Select", key=f"sel_{unique_key}")
+            approve_key = f"approve_{unique_key}"
+            if st.button("✅ Approve", key=approve_key, use_container_width=True):
+                try:
+                    updated = update_label_mapping_status(item.raw_label, item.industry, "APPROVED", new_label=edited_label)
+                    remove_from_queue(item)
+                    if updated:
                         st.toast(f"Approved: '{item.raw_label}' -> '{edited_label}'", icon="✅")
-                        st.rerun()
-                    except Exception as e:
-                        st.error(f"Failed to approve '{item.raw_label}': {e}")
-
-                reject_key = f"reject_{unique_key}"
-                if st.button("❌ Reject", key=reject_key, use_container_width=True):
-                    try:
-                        update_label_mapping_status(item.raw_label, item.industry, "REJECTED")
+                    else:
+                        st.toast(f"'{item.raw_label}' no longer exists; removed from queue", icon="⚠️")
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"Failed to approve '{item.raw_label}': {e}")
+
+            reject_key = f"reject_{unique_key}"
+            if st.button("❌ Reject", key=reject_key, use_container_width=True):
+                try:
+                    updated = update_label_mapping_status(item.raw_label, item.industry, "REJECTED")
+                    remove_from_queue(item)
+                    if updated:
                         st.toast(f"Rejected: '{item.raw_label}'", icon="❌")
-                        st.rerun()
-                    except Exception as e:
-                        st.error(f"Failed to reject '{item.raw_label}': {e}")
-        st.markdown("---")
-finally:
-    # Ensure the session is closed when the script finishes or is interrupted
-    if 'db_session' in locals() and db_session.is_active:
-        db_session.close()
\ No newline at end of file
+                    else:
+                        st.toast(f"'{item.raw_label}' no longer exists; removed from queue", icon="⚠️")
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"Failed to reject '{item.raw_label}': {e}")
+    st.markdown("---")
@@ -12,15 +12,15 @@ except IndexError:
     # Handle cases where the script is not in the expected directory
     st.error("Could not find project root. Please ensure the script is in the correct directory.")
     st.stop()
-import json
-import time
+import pandas as pd
+from collections import defaultdict
 from datetime import datetime
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Tuple
 
 # Import database functions
 from earnings_agent.storage.database import (
-    get_session,
     get_pending_unit_reviews,
+    get_unit_review_detail,
     approve_unit_review,
     delete_processed_unit_review
 )
@@ -33,93 +33,103 @@ st.set_page_config(
     layout="wide"
 )
 
-def get_representation_options(representation: str) -> List[str]:
+# Static option tables, built once at import rather than per figure per rerun
+_REP_OPTIONS = {
+    'currency': ('lakhs', 'crores', 'millions', 'thousands', 'rupees'),
+    'percentage': ('percentage',),
+    'ratio': ('percentage', 'absolute', 'basis_points'),
+    'count': ('count',)
+}
+_UNKNOWN_REP_OPTIONS = ('unknown',)
+_RATIO_OPTIONS = ('percentage', 'absolute', 'basis_points')
+_NO_RATIO_OPTIONS = ('null',)
+
+def get_representation_options(representation: str) -> tuple:
     """
     Return dropdown options based on representation type.
     """
-    options_map = {
-        'currency': ['lakhs', 'crores', 'millions', 'thousands', 'rupees'],
-        'percentage': ['percentage'],
-        'ratio': ['percentage', 'absolute', 'basis_points'],
-        'count': ['count']
-    }
-    return options_map.get(representation, ['unknown'])
+    return _REP_OPTIONS.get(representation, _UNKNOWN_REP_OPTIONS)
 
-def get_ratio_context_options(representation: str) -> List[str]:
+def get_ratio_context_options(representation: str) -> tuple:
     """
     Return ratio context options based on representation type.
     """
-    if representation in ['percentage', 'ratio']:
-        return ['percentage', 'absolute', 'basis_points']
-    return ['null']
+    if representation in ('percentage', 'ratio'):
+        return _RATIO_OPTIONS
+    return _NO_RATIO_OPTIONS
+
+# Union of every per-representation option, for the table's select columns
+CURRENCY_OPTIONS = list(dict.fromkeys(
+    opt for opts in (*_REP_OPTIONS.values(), _UNKNOWN_REP_OPTIONS) for opt in opts
+))
+RATIO_OPTIONS = [*_RATIO_OPTIONS, *_NO_RATIO_OPTIONS]
 
-def display_figure_review(figure: Dict, statement_info: Dict, review_id: int, figure_index: int) -> Dict:
+def _initial_option(options: tuple, current: Any) -> str:
+    """Current value if it's a valid option, otherwise the first option (selectbox default)."""
+    return current if current in options else options[0]
+
+def display_figures_review_table(suspicious_figures: List[Dict], review_id: int) -> Tuple[List[Dict], List[str]]:
     """
-    Display individual figure for review and return user corrections.
+    Display all suspicious figures in one editable table.
+    Returns (user corrections, labels whose selected units don't fit their representation);
+    the select columns list every unit, so the caller must refuse approval while the latter is non-empty.
     """
-    col1, col2, col3, col4 = st.columns([3, 1, 2, 2])
-    
-    with col1:
-        st.write(f"**{figure['label']}**")
-        st.write(f"Value: {figure['value']}")
-        st.write(f"Statement: {statement_info['standard_mapping']}")
-    
-    with col2:
-        st.write("**LLM Analysis:**")
-        st.write(f"Rep: {figure['representation']}")
-        st.write(f"Confidence: {figure.get('confidence', 'unknown')}")
-    
-    with col3:
-        st.write("**Currency Context:**")
-        currency_options = get_representation_options(figure['representation'])
-        
-        # Find current selection index
-        current_currency = figure.get('currency_context', 'unknown')
-        try:
-            current_idx = currency_options.index(current_currency)
-        except ValueError:
-            current_idx = 0
-        
-        selected_currency = st.selectbox(
-            "Currency/Unit:",
-            options=currency_options,
-            index=current_idx,
-            # --- MODIFIED LINE ---
-            key=f"currency_{review_id}_{figure_index}_{figure['label']}"
-        )
-    
-    with col4:
-        st.write("**Ratio Context:**")
-        ratio_options = get_ratio_context_options(figure['representation'])
-        
-        # Find current selection index
-        current_ratio = figure.get('ratio_context', 'null')
-        try:
-            current_ratio_idx = ratio_options.index(current_ratio)
-        except ValueError:
-            current_ratio_idx = 0
-        
-        selected_ratio = st.selectbox(
-            "Ratio Type:",
-            options=ratio_options,
-            index=current_ratio_idx,
-            # --- MODIFIED LINE ---
-            key=f"ratio_{review_id}_{figure_index}_{figure['label']}"
+    rows = [
+        {
+            'label': figure['label'],
+            'value': figure['value'],
+            'statement': figure.get('standard_mapping', 'unknown'),
+            'representation': figure['representation'],
+            'currency_context': _initial_option(
+                get_representation_options(figure['representation']), figure.get('currency_context', 'unknown')
+            ),
+            'ratio_context': _initial_option(
+                get_ratio_context_options(figure['representation']), figure.get('ratio_context', 'null')
+            ),
+            'confidence': figure.get('confidence', 'unknown'),
+            'reasoning': figure.get('reasoning') or ''
+        }
+        for figure in suspicious_figures
+    ]
+
+    edited = st.data_editor(
+        pd.DataFrame(rows),
+        key=f"figures_{review_id}",
+        column_config={
+            'currency_context': st.column_config.SelectboxColumn("Currency/Unit", options=CURRENCY_OPTIONS, required=True),
+            'ratio_context': st.column_config.SelectboxColumn("Ratio Type", options=RATIO_OPTIONS, required=True),
+            'reasoning': st.column_config.TextColumn("LLM Reasoning", width="large"),
+        },
+        disabled=['label', 'value', 'statement', 'representation', 'confidence', 'reasoning'],
+        num_rows="fixed",
+        hide_index=True,
+        use_container_width=True
+    )
+
+    corrections = []
+    invalid_rows = []
+    for row in edited.to_dict('records'):
+        if row['currency_context'] not in get_representation_options(row['representation']):
+            invalid_rows.append(row['label'])
+        if row['ratio_context'] not in get_ratio_context_options(row['representation']):
+            invalid_rows.append(row['label'])
+        corrections.append({
+            'label': row['label'],
+            'currency_context': row['currency_context'] if row['currency_context'] != 'unknown' else None,
+            'ratio_context': row['ratio_context'] if row['ratio_context'] != 'null' else None,
+            'representation': row['representation']  # Keep original representation
+        })
+
+    invalid_rows = list(dict.fromkeys(invalid_rows))
+    if invalid_rows:
+        st.error(
+            "Selected units don't match the figure's representation for: "
+            + ", ".join(invalid_rows)
+            + ". Fix these before approving."
         )
-    
-    # Show reasoning if available
-    if figure.get('reasoning'):
-        st.info(f"LLM Reasoning: {figure['reasoning']}")
-    
-    # Return user corrections
-    corrections = {
-        'label': figure['label'],
-        'currency_context': selected_currency if selected_currency != 'unknown' else None,
-        'ratio_context': selected_ratio if selected_ratio != 'null' else None,
-        'representation': figure['representation']  # Keep original representation
-    }
-    
-    return corrections
+
+    return corrections, invalid_rows
+
 def display_filing_summary(review: UnitReviewQueue):
     """
     Display summary information about the filing under review.
@@ -144,42 +154,53 @@ def display_filing_summary(review: UnitReviewQueue):
 def create_corrected_analysis(original_analysis: Dict, user_corrections: List[Dict]) -> Dict:
     """
     Apply user corrections to the original LLM analysis.
+    Returns a new analysis that shares every untouched statement/figure dict with the
+    original; only corrected figures and the containers on their path are copied.
     """
-    corrected_analysis = json.loads(json.dumps(original_analysis))  # Deep copy
-    
-    # Create correction mapping by label
-    corrections_map = {corr['label']: corr for corr in user_corrections}
-    
-    # Apply corrections to each statement
-    for stmt_analysis in corrected_analysis['statement_analyses']:
-        for figure in stmt_analysis['figures']:
-            if figure['label'] in corrections_map:
-                correction = corrections_map[figure['label']]
-                
+    statement_analyses = original_analysis['statement_analyses']
+
+    # One pass to locate every figure by label (a label can appear in several statements)
+    label_positions = defaultdict(list)
+    for i, stmt_analysis in enumerate(statement_analyses):
+        for j, figure in enumerate(stmt_analysis['figures']):
+            label_positions[figure['label']].append((i, j))
+
+    corrected_statements = list(statement_analyses)
+    copied = set()  # statement indexes already shallow-copied
+    for correction in user_corrections:
+        for i, j in label_positions.get(correction['label'], ()):
+            if i not in copied:
+                stmt_analysis = corrected_statements[i]
+                corrected_statements[i] = {**stmt_analysis, 'figures': list(stmt_analysis['figures'])}
+                copied.add(i)
+            figures = corrected_statements[i]['figures']
+            figures[j] = {
+                **figures[j],
                 # Apply user corrections
-                figure['currency_context'] = correction['currency_context']
-                figure['ratio_context'] = correction['ratio_context']
-                
+                'currency_context': correction['currency_context'],
+                'ratio_context': correction['ratio_context'],
                 # Mark as human reviewed
-                figure['confidence'] = 'high'  # Human review makes it high confidence
-                figure['reasoning'] = 'Human reviewed and corrected'
-    
-    # Update filing analysis
-    corrected_analysis['filing_analysis']['requires_human_review'] = False
-    corrected_analysis['filing_analysis']['confidence_summary'] = 'Human reviewed and approved'
-    
-    return corrected_analysis
+                'confidence': 'high',  # Human review makes it high confidence
+                'reasoning': 'Human reviewed and corrected'
+            }
+
+    return {
+        **original_analysis,
+        'statement_analyses': corrected_statements,
+        # Update filing analysis
+        'filing_analysis': {
+            **original_analysis['filing_analysis'],
+            'requires_human_review': False,
+            'confidence_summary': 'Human reviewed and approved'
+        }
+    }
 
 def main():
     st.title("🔍 Unit Normalization Review")
     st.markdown("Review and correct unit normalization decisions for financial figures")
     
     # Get pending reviews
-    session = get_session()
-    try:
-        pending_reviews = get_pending_unit_reviews()
-    finally:
-        session.close()
+    pending_reviews = get_pending_unit_reviews()
     
     if not pending_reviews:
         st.success("🎉 No pending unit reviews! All filings have been processed.")
@@ -189,7 +210,7 @@ def main():
     
     # Select review to work on
     review_options = [
-        f"{review.ticker} - {review.fiscal_date} ({review.filing_data.get('low_confidence_count', 0)} figures)"
+        f"{review.ticker} - {review.fiscal_date} ({review.low_confidence_count} figures)"
         for review in pending_reviews
     ]
     
@@ -202,8 +223,12 @@ def main():
     if selected_idx is None:
         st.stop()
     
-    current_review = pending_reviews[selected_idx]
-    
+    # The list rows carry no JSON payloads; load them only for the selected filing
+    current_review = get_unit_review_detail(pending_reviews[selected_idx].id)
+    if current_review is None:
+        st.info("This filing is no longer pending review; refresh the list.")
+        st.stop()
+
     # Display filing summary
     display_filing_summary(current_review)
     
@@ -217,38 +242,18 @@ def main():
         
         # Auto-approve button
         if st.button("Auto-Approve Filing", type="primary"):
-            session = get_session()
             try:
                 approve_unit_review(current_review.id)
-                session.commit()
-                st.success("Filing approved successfully!")
+                st.toast("Filing approved successfully!", icon="✅")
                 st.rerun()
             except Exception as e:
                 st.error(f"Error approving filing: {e}")
-                session.rollback()
-            finally:
-                session.close()
         st.stop()
     
     # Display figures for review
     st.subheader(f"Review {len(suspicious_figures)} Suspicious Figures")
     
-    user_corrections = []
-    
-    for i, figure in enumerate(suspicious_figures):
-        st.markdown(f"### Figure {i+1}")
-        
-        # Create statement info
-        statement_info = {
-            'standard_mapping': figure.get('standard_mapping', 'unknown'),
-            'statement_type': figure.get('statement_type', 'unknown')
-        }
-        
-        # --- MODIFIED LINE: Pass the index `i` ---
-        correction = display_figure_review(figure, statement_info, current_review.id, figure_index=i)
-        user_corrections.append(correction)
-        
-        st.markdown("---")
+    user_corrections, invalid_rows = display_figures_review_table(suspicious_figures, current_review.id)
     
     # Approval buttons
     col1, col2, col3 = st.columns([1, 1, 1])
@@ -262,7 +267,7 @@ def main():
             st.info("Auto-save functionality not implemented yet.")
     
     with col3:
-        if st.button("✅ Approve Filing", type="primary"):
+        if st.button("✅ Approve Filing", type="primary", disabled=bool(invalid_rows)):
             try:
                 # Create corrected analysis
                 corrected_analysis = create_corrected_analysis(
@@ -270,21 +275,14 @@ def main():
                     user_corrections
                 )
                 
-                # Approve with corrections
-                session = get_session()
+                # Approve with corrections (approve_unit_review manages its own session)
                 try:
                     approve_unit_review(current_review.id, corrected_analysis)
-                    session.commit()
-                    st.success("Filing approved with corrections!")
-                    st.balloons()
-                    time.sleep(2)
+                    st.toast("Filing approved with corrections!", icon="✅")
                     st.rerun()
                     
                 except Exception as e:
                     st.error(f"Error approving filing: {e}")
-                    session.rollback()
-                finally:
-                    session.close()
                     
             except Exception as e:
                 st.error(f"Error creating corrections: {e}")
@@ -3,15 +3,14 @@
 import logging
 import json
 import hashlib
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, List, Tuple, Iterable, Optional
 from datetime import date
-from sqlalchemy import select
+from sqlalchemy import select, update, bindparam, case, func, literal_column
+from sqlalchemy.dialects.postgresql import insert as pg_insert, array as pg_array
 
 from earnings_agent.storage.database import (
     get_session,
     get_docs_pending_statement_normalization,
-    create_staged_normalized_data,
-    mark_docs_statement_normalized, # We will use this again
 )
 from earnings_agent.storage.models import (
     ParsedDocument,
@@ -27,43 +26,110 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Expected statements mapping
-EXPECTED_STATEMENTS = [
-    'standalone_pnl',
-    'standalone_balance_sheet', 
-    'standalone_cash_flow',
-    'consolidated_pnl',
-    'consolidated_balance_sheet',
-    'consolidated_cash_flow'
-]
+# Expected statements mapping (immutable, built once at import)
+STANDALONE_STATEMENTS = ('standalone_pnl', 'standalone_balance_sheet', 'standalone_cash_flow')
+CONSOLIDATED_STATEMENTS = ('consolidated_pnl', 'consolidated_balance_sheet', 'consolidated_cash_flow')
+EXPECTED_STATEMENTS = STANDALONE_STATEMENTS + CONSOLIDATED_STATEMENTS
+# standard_mapping -> filing kind, so categorization is one dict lookup instead of substring scans
+CLASSIFICATION = {
+    **{s: 'standalone' for s in STANDALONE_STATEMENTS},
+    **{s: 'consolidated' for s in CONSOLIDATED_STATEMENTS},
+}
+
+# Core (not ORM) UPDATE keyed on doc_id, run executemany-style with one parameter set per document
+_staged_table = StagedNormalizedData.__table__
+STAGED_RECORD_UPDATE = (
+    update(_staged_table)
+    .where(_staged_table.c.doc_id == bindparam('b_doc_id'))
+    .values(
+        normalized_data=bindparam('b_normalized_data'),
+        data_hash=bindparam('b_data_hash'),
+        statement_normalized=True
+    )
+)
+
+# Fiscal quarter -> (year offset, month, day) of the quarter end; anything else is Q4
+QUARTER_END_DATES = {
+    1: (0, 6, 30),
+    2: (0, 9, 30),
+    3: (0, 12, 31),
+}
+Q4_END_DATE = (1, 3, 31)
+
+def fetch_metadata_bulk(doc_ids: Iterable[int], session) -> Dict[int, Tuple[str, date]]:
+    """
+    Resolve (ticker, fiscal_date) for many documents with a single JOIN query
+    (ParsedDocument -> JobAssetLink -> IngestionJob) instead of walking the lazy-loaded
+    relationships once per document. Documents without a job link are absent from the result.
+    """
+    doc_ids = list(doc_ids)
+    if not doc_ids:
+        return {}
+
+    stmt = (
+        select(ParsedDocument.doc_id, IngestionJob.ticker, IngestionJob.fiscal_year, IngestionJob.quarter)
+        .join(JobAssetLink, JobAssetLink.asset_id == ParsedDocument.asset_id)
+        .join(IngestionJob, IngestionJob.job_id == JobAssetLink.job_id)
+        .where(ParsedDocument.doc_id.in_(doc_ids))
+        .order_by(ParsedDocument.doc_id, JobAssetLink.job_id)
+    )
+
+    metadata = {}
+    for doc_id, ticker, fiscal_year, quarter in session.execute(stmt):
+        if doc_id in metadata:
+            continue  # An asset can be linked to several jobs; keep the first one
+        year_offset, month, day = QUARTER_END_DATES.get(quarter, Q4_END_DATE)
+        metadata[doc_id] = (ticker, date(fiscal_year + year_offset, month, day))
+    return metadata
+
+def stage_new_documents(session) -> int:
+    """
+    Create the initial (empty) staged record for every PARSED_OK document that has none yet,
+    as one server-side INSERT ... SELECT with ticker and fiscal_date derived in SQL.
+    Returns the number of rows inserted; the caller commits.
+    """
+    fiscal_date = case(
+        *(
+            (IngestionJob.quarter == quarter, func.make_date(IngestionJob.fiscal_year + year_offset, month, day))
+            for quarter, (year_offset, month, day) in QUARTER_END_DATES.items()
+        ),
+        else_=func.make_date(IngestionJob.fiscal_year + Q4_END_DATE[0], Q4_END_DATE[1], Q4_END_DATE[2])
+    )
+    # NOT EXISTS anti-join probes the unique doc_id index instead of joining every staged row;
+    # DISTINCT ON keeps one job per document, as fetch_metadata_bulk does.
+    new_docs = (
+        select(
+            ParsedDocument.doc_id,
+            IngestionJob.ticker,
+            fiscal_date,
+            literal_column("'{}'::jsonb")
+        )
+        .join(JobAssetLink, JobAssetLink.asset_id == ParsedDocument.asset_id)
+        .join(IngestionJob, IngestionJob.job_id == JobAssetLink.job_id)
+        .where(
+            ParsedDocument.parse_status == 'PARSED_OK',
+            ~select(StagedNormalizedData.id)
+            .where(StagedNormalizedData.doc_id == ParsedDocument.doc_id)
+            .exists()
+        )
+        .distinct(ParsedDocument.doc_id)
+        .order_by(ParsedDocument.doc_id, JobAssetLink.job_id)
+    )
+    stmt = (
+        pg_insert(StagedNormalizedData)
+        .from_select(['doc_id', 'ticker', 'fiscal_date', 'normalized_data'], new_docs)
+        .on_conflict_do_nothing(index_elements=['doc_id'])
+    )
+    return session.execute(stmt).rowcount
 
 def extract_company_and_period_metadata(doc_id: int, session) -> Tuple[str, date]:
     """
     Extract company ticker and fiscal_date from the document lineage.
     """
-    parsed_doc = session.get(ParsedDocument, doc_id)
-    if not parsed_doc:
-        raise ValueError(f"ParsedDocument with doc_id {doc_id} not found")
-    
-    asset = parsed_doc.asset
-    if not asset or not asset.job_links:
-        raise ValueError(f"No job links found for asset_id {parsed_doc.asset_id}")
-    
-    job_link = asset.job_links[0]
-    job = job_link.job
-    
-    ticker = job.ticker
-    
-    if job.quarter == 1:
-        fiscal_date = date(job.fiscal_year, 6, 30)
-    elif job.quarter == 2:
-        fiscal_date = date(job.fiscal_year, 9, 30)
-    elif job.quarter == 3:
-        fiscal_date = date(job.fiscal_year, 12, 31)
-    else:
-        fiscal_date = date(job.fiscal_year + 1, 3, 31)
-    
-    return ticker, fiscal_date
+    metadata = fetch_metadata_bulk([doc_id], session).get(doc_id)
+    if not metadata:
+        raise ValueError(f"No job lineage found for doc_id {doc_id}")
+    return metadata
 
 # --- START: MISSING HELPER FUNCTIONS ---
 def create_statement_mapping(statements_found: List[Dict], raw_statements: List[Dict]) -> Dict[str, str]:
@@ -81,9 +147,10 @@ def create_statement_mapping(statements_found: List[Dict], raw_statements: List[
 def categorize_statements(raw_statements: List[Dict], statement_mapping: Dict[str, str]) -> Dict[str, Any]:
     """
     Categorize statements into standalone and consolidated filings.
+    Each mapped statement dict in raw_statements gains a 'standard_mapping' key (mutated in place).
     """
-    standalone_statements = []
-    consolidated_statements = []
+    # Per kind, keyed by standard_mapping; the first statement seen for a mapping wins
+    by_kind = {'standalone': {}, 'consolidated': {}}
     found_statements = set()
     
     for statement in raw_statements:
@@ -94,59 +161,43 @@ def categorize_statements(raw_statements: List[Dict], statement_mapping: Dict[st
             logger.warning(f"No mapping found for statement: {statement_name}")
             continue
             
-        statement_with_mapping = statement.copy()
-        statement_with_mapping['standard_mapping'] = standard_mapping
+        # Tag in place: raw_statements is decoded fresh per document and not reused by the caller
+        statement['standard_mapping'] = standard_mapping
         found_statements.add(standard_mapping)
         
-        if 'standalone' in standard_mapping:
-            standalone_statements.append(statement_with_mapping)
-        elif 'consolidated' in standard_mapping:
-            consolidated_statements.append(statement_with_mapping)
+        kind = CLASSIFICATION.get(standard_mapping)
+        if kind:
+            by_kind[kind].setdefault(standard_mapping, statement)
         else:
             logger.warning(f"Unknown statement type mapping: {standard_mapping}")
     
-    standalone_filing = {}
-    consolidated_filing = {}
-    
-    for expected in ['standalone_pnl', 'standalone_balance_sheet', 'standalone_cash_flow']:
-        found_stmt = next((stmt for stmt in standalone_statements if stmt['standard_mapping'] == expected), None)
-        standalone_filing[expected] = found_stmt if found_stmt else "NOT_PROVIDED"
-    
-    for expected in ['consolidated_pnl', 'consolidated_balance_sheet', 'consolidated_cash_flow']:
-        found_stmt = next((stmt for stmt in consolidated_statements if stmt['standard_mapping'] == expected), None)
-        consolidated_filing[expected] = found_stmt if found_stmt else "NOT_PROVIDED"
+    standalone_filing = {k: by_kind['standalone'].get(k, "NOT_PROVIDED") for k in STANDALONE_STATEMENTS}
+    consolidated_filing = {k: by_kind['consolidated'].get(k, "NOT_PROVIDED") for k in CONSOLIDATED_STATEMENTS}
     
     return {
         'standalone': standalone_filing,
         'consolidated': consolidated_filing,
         'found_statements': list(found_statements),
+        # Declaration order, as stored in existing rows (found_statements is a set, so each test is O(1))
         'missing_statements': [stmt for stmt in EXPECTED_STATEMENTS if stmt not in found_statements]
     }
 # --- END: MISSING HELPER FUNCTIONS ---
 
-def normalize_single_document(doc_id: int, session) -> bool:
+def normalize_single_document(
+    doc_id: int, statements_found: List[Dict], raw_statements: Any, ticker: str, fiscal_date: date
+) -> Optional[Dict[str, Any]]:
     """
-    Normalize statements for a single parsed document and UPDATE the existing staged record.
-    Returns True if successful, False otherwise.
+    Normalize statements for a single parsed document.
+    `statements_found` (content.llm_call_1.statements_found), `raw_statements` (content.llm_call_2)
+    and the ticker/fiscal_date are pre-fetched by the caller for the whole batch. No DB access:
+    returns the staged-record update row (bind names as used by STAGED_RECORD_UPDATE), or None
+    if the document could not be normalized.
     """
     try:
-        parsed_doc = session.get(ParsedDocument, doc_id)
-        if not parsed_doc or not parsed_doc.content:
-            logger.error(f"No content found for doc_id {doc_id}")
-            return False
-        
-        content = parsed_doc.content
-        if 'llm_call_1' not in content or 'llm_call_2' not in content:
-            logger.error(f"Invalid content structure for doc_id {doc_id}")
-            return False
-        
-        statements_found = content['llm_call_1'].get('statements_found', [])
-        raw_statements = content['llm_call_2']
         if not isinstance(raw_statements, list):
             logger.error(f"llm_call_2 is not a list for doc_id {doc_id}")
-            return False
+            return None
         
-        ticker, fiscal_date = extract_company_and_period_metadata(doc_id, session)
         logger.info(f"Processing document {doc_id} for {ticker} {fiscal_date}")
         
         statement_mapping = create_statement_mapping(statements_found, raw_statements)
@@ -165,22 +216,15 @@ def normalize_single_document(doc_id: int, session) -> bool:
             }
         }
         
-        data_hash = hashlib.sha256(json.dumps(normalized_data, sort_keys=True).encode()).hexdigest()
+        # Compact canonical JSON + BLAKE2b (256-bit, same 64-char hex width as SHA-256)
+        canonical = json.dumps(normalized_data, sort_keys=True, separators=(',', ':')).encode()
+        data_hash = hashlib.blake2b(canonical, digest_size=32).hexdigest()
         
-        staged_record = session.query(StagedNormalizedData).filter_by(doc_id=doc_id).one()
-        staged_record.normalized_data = normalized_data
-        staged_record.data_hash = data_hash
-        
-        # This commit is for the update of a single document
-        session.commit()
-        
-        logger.info(f"Successfully normalized and updated staged record for doc_id {doc_id}")
-        return True
+        return {'b_doc_id': doc_id, 'b_normalized_data': normalized_data, 'b_data_hash': data_hash}
         
     except Exception as e:
         logger.error(f"Error processing doc_id {doc_id}: {e}", exc_info=True)
-        session.rollback()
-        return False
+        return None
 
 def run_statement_normalizer_batch():
     """
@@ -190,29 +234,12 @@ def run_statement_normalizer_batch():
     session = get_session()
     
     try:
-        logger.info("   🔍 Searching for parsed documents not yet staged for normalization...")
-        stmt = (
-            select(ParsedDocument.doc_id)
-            .outerjoin(StagedNormalizedData, ParsedDocument.doc_id == StagedNormalizedData.doc_id)
-            .where(
-                ParsedDocument.parse_status == 'PARSED_OK',
-                StagedNormalizedData.id == None
-            )
-        )
-        docs_to_stage = session.execute(stmt).scalars().all()
+        logger.info("   🔍 Staging parsed documents not yet staged for normalization...")
+        staged_count = stage_new_documents(session)
+        session.commit()
         
-        if docs_to_stage:
-            logger.info(f"   Found {len(docs_to_stage)} new documents to stage. Creating initial records...")
-            for doc_id in docs_to_stage:
-                ticker, fiscal_date = extract_company_and_period_metadata(doc_id, session)
-                staged_data = {
-                    'doc_id': doc_id,
-                    'ticker': ticker,
-                    'fiscal_date': fiscal_date,
-                    'normalized_data': {}
-                }
-                create_staged_normalized_data(staged_data)
-            logger.info("   ✅ Initial staging records created.")
+        if staged_count:
+            logger.info(f"   ✅ Created {staged_count} initial staging records.")
         else:
             logger.info("   All parsed documents are already staged.")
 
@@ -222,18 +249,49 @@ def run_statement_normalizer_batch():
             return
 
         logger.info(f"Found {len(doc_ids_to_normalize)} documents pending statement normalization.")
-        successful_docs = []
+        updates = []
         failed_docs = []
+        metadata = fetch_metadata_bulk(doc_ids_to_normalize, session)
+        
+        # One SELECT for every pending document, projecting only the two JSONB sub-trees the
+        # normalizer reads (content -> ...) rather than transferring and decoding the whole blob
+        content = ParsedDocument.content
+        content_by_id = {
+            row.doc_id: row for row in session.execute(
+                select(
+                    ParsedDocument.doc_id,
+                    content.has_all(pg_array(['llm_call_1', 'llm_call_2'])).label('has_calls'),
+                    content['llm_call_1']['statements_found'].label('statements_found'),
+                    content['llm_call_2'].label('raw_statements')
+                )
+                .where(ParsedDocument.doc_id.in_(doc_ids_to_normalize))
+            )
+        }
         
         for doc_id in doc_ids_to_normalize:
-            if normalize_single_document(doc_id, session):
-                successful_docs.append(doc_id)
+            if doc_id not in metadata:
+                logger.error(f"No job lineage found for doc_id {doc_id}")
+                failed_docs.append(doc_id)
+                continue
+            doc_content = content_by_id.get(doc_id)
+            if doc_content is None or not doc_content.has_calls:
+                logger.error(f"No content or invalid content structure for doc_id {doc_id}")
+                failed_docs.append(doc_id)
+                continue
+            ticker, fiscal_date = metadata[doc_id]
+            row = normalize_single_document(
+                doc_id, doc_content.statements_found or [], doc_content.raw_statements, ticker, fiscal_date
+            )
+            if row:
+                updates.append(row)
             else:
                 failed_docs.append(doc_id)
         
-        if successful_docs:
-            mark_docs_statement_normalized(successful_docs)
-            logger.info(f"Marked {len(successful_docs)} documents as statement-normalized.")
+        if updates:
+            # One executemany UPDATE (data + statement_normalized flag) and one commit for the batch
+            session.execute(STAGED_RECORD_UPDATE, updates)
+            session.commit()
+            logger.info(f"Normalized and marked {len(updates)} documents as statement-normalized.")
         
         if failed_docs:
             logger.warning(f"Failed to process {len(failed_docs)} documents: {failed_docs}")
@@ -3,9 +3,18 @@
 import logging
 import json
 import hashlib
-from typing import Dict, Any, List, Tuple, Optional
+import os
+import asyncio
+from typing import Dict, Any, List, Tuple, Optional, Iterator
 from datetime import date, datetime
 
+from sqlalchemy.orm.attributes import flag_modified
+
+try:
+    import orjson
+except ImportError:  # orjson is an optional faster decoder for large LLM responses
+    orjson = None
+
 from earnings_agent.storage.database import (
     get_session,
     get_docs_pending_unit_normalization,
@@ -15,7 +24,7 @@ from earnings_agent.storage.database import (
     delete_processed_unit_review,
 )
 from earnings_agent.storage.models import ParsedDocument, StagedNormalizedData, UnitReviewQueue
-from earnings_agent.llm.normalizer_client import call_gemini_with_json
+from earnings_agent.llm.normalizer_client import call_gemini_with_json, call_gemini_with_json_async
 
 # Standard logging configuration
 logging.basicConfig(
@@ -26,6 +35,8 @@ logger = logging.getLogger(__name__)
 
 # LLM Configuration
 UNIT_ANALYSIS_MODEL = "gemini-2.5-pro" # Using a standard, available model
+# Max in-flight unit-analysis LLM calls; tune to the Gemini rate limit
+UNIT_MAX_WORKERS = int(os.getenv("EARNINGS_UNIT_LLM_WORKERS", "8"))
 
 UNIT_ANALYSIS_PROMPT = """
 You are a financial data analyst. You will analyze financial statement figures to determine their exact unit representation.
@@ -88,9 +99,11 @@ IMPORTANT:
 - IMPORTANT: ENSURE STRICT JSON FORMAT IN THE EXPECTED STRUCTURE GIVEN ABOVE!!!!!!
 """
 
-def get_filing_context_for_analysis(doc_id: int, session) -> Tuple[Dict, Dict]:
+def get_filing_context_for_analysis(doc_id: int, session) -> Tuple[StagedNormalizedData, Dict]:
     """
     Extract complete filing context for LLM analysis.
+    Returns the staged record itself (callers read ticker/fiscal_date and the
+    statement-normalized data from it) plus the original parsed content.
     """
     # --- THIS IS THE FIX ---
     # Look up by doc_id using filter_by, not the primary key 'id' with get().
@@ -99,29 +112,27 @@ def get_filing_context_for_analysis(doc_id: int, session) -> Tuple[Dict, Dict]:
         raise ValueError(f"No staged data found for doc_id {doc_id}")
     # --- END OF FIX ---
     
-    statement_normalized_data = staged_data.normalized_data.get('statement_normalized_data', {})
-    
     parsed_doc = session.get(ParsedDocument, doc_id)
     if not parsed_doc:
         raise ValueError(f"No parsed document found for doc_id {doc_id}")
     
     original_content = parsed_doc.content
     
-    return statement_normalized_data, original_content
+    return staged_data, original_content
 
 def create_llm_analysis_payload(statement_data: Dict, original_content: Dict, ticker: str, fiscal_date: date) -> str:
     """
     Create the analysis payload combining statement data with original currency contexts.
     """
-    original_statements = []
-    if 'llm_call_2' in original_content:
-        for stmt in original_content['llm_call_2']:
-            original_statements.append({
-                "statement_type": stmt.get('statement_type', ''),
-                "currency": stmt.get('currency', ''),
-                "quarter": stmt.get('quarter', ''),
-                "figures": stmt.get('figures', [])
-            })
+    original_statements = [
+        {
+            "statement_type": stmt.get('statement_type', ''),
+            "currency": stmt.get('currency', ''),
+            "quarter": stmt.get('quarter', ''),
+            "figures": stmt.get('figures', [])
+        }
+        for stmt in original_content.get('llm_call_2', ())
+    ]
     
     analysis_context = {
         "company": ticker,
@@ -130,14 +141,16 @@ def create_llm_analysis_payload(statement_data: Dict, original_content: Dict, ti
         "note": "Use the 'currency' field from each statement for currency figures in that statement"
     }
     
-    return json.dumps(analysis_context, indent=2)
+    # Compact JSON: indentation only adds billed tokens and request bytes for the LLM
+    return json.dumps(analysis_context, separators=(',', ':'), ensure_ascii=False)
 
 def parse_llm_unit_analysis(response_text: str) -> Dict:
     """
     Parse and validate LLM response for unit analysis.
     """
     try:
-        analysis = json.loads(response_text.strip())
+        # orjson.JSONDecodeError subclasses json.JSONDecodeError, so the except clause covers both
+        analysis = orjson.loads(response_text) if orjson else json.loads(response_text)
         required_keys = ['filing_analysis', 'statement_analyses']
         if not all(key in analysis for key in required_keys):
             raise ValueError("Missing required keys in LLM response")
@@ -147,19 +160,34 @@ def parse_llm_unit_analysis(response_text: str) -> Dict:
         logger.error(f"Response was: {response_text}")
         raise ValueError("Could not parse unit analysis from LLM") from e
 
-def analyze_units_with_llm(doc_id: int, session) -> Dict:
+def analyze_units_with_llm(doc_id: int, ticker: str, analysis_payload: str) -> Dict:
     """
     Send filing to LLM for contextual unit analysis.
+    Pure I/O (no session use).
     """
     try:
-        statement_data, original_content = get_filing_context_for_analysis(doc_id, session)
-        staged_data = session.query(StagedNormalizedData).filter_by(doc_id=doc_id).one()
-        
-        analysis_payload = create_llm_analysis_payload(
-            statement_data, original_content, staged_data.ticker, staged_data.fiscal_date
+        response_text = call_gemini_with_json(
+            model_name=UNIT_ANALYSIS_MODEL,
+            prompt=UNIT_ANALYSIS_PROMPT,
+            context_text=analysis_payload,
+            temperature=0.0,
+            max_tokens=65536
         )
         
-        response_text = call_gemini_with_json(
+        analysis_result = parse_llm_unit_analysis(response_text)
+        logger.info(f"Completed unit analysis for doc_id {doc_id} ({ticker})")
+        return analysis_result
+        
+    except Exception as e:
+        logger.error(f"Error in LLM unit analysis for doc_id {doc_id}: {e}", exc_info=True)
+        raise
+
+async def analyze_units_with_llm_async(doc_id: int, ticker: str, analysis_payload: str) -> Dict:
+    """
+    Async counterpart of analyze_units_with_llm, for fanning out a batch on one event loop.
+    """
+    try:
+        response_text = await call_gemini_with_json_async(
             model_name=UNIT_ANALYSIS_MODEL,
             prompt=UNIT_ANALYSIS_PROMPT,
             context_text=analysis_payload,
@@ -168,32 +196,62 @@ def analyze_units_with_llm(doc_id: int, session) -> Dict:
         )
         
         analysis_result = parse_llm_unit_analysis(response_text)
-        logger.info(f"Completed unit analysis for doc_id {doc_id} ({staged_data.ticker})")
+        logger.info(f"Completed unit analysis for doc_id {doc_id} ({ticker})")
         return analysis_result
         
     except Exception as e:
         logger.error(f"Error in LLM unit analysis for doc_id {doc_id}: {e}", exc_info=True)
         raise
 
-def determine_review_requirement(analysis: Dict) -> Tuple[bool, List[Dict]]:
+async def _analyze_all(tasks: Dict[int, Tuple[str, str]]) -> Dict[int, Any]:
     """
-    Determine if human review is required based on LLM analysis.
+    Run analyze_units_with_llm_async for every doc_id -> (ticker, payload), at most
+    UNIT_MAX_WORKERS in flight. Failed documents map to their exception.
     """
-    suspicious_figures = []
+    semaphore = asyncio.Semaphore(UNIT_MAX_WORKERS)
+    
+    async def _bounded(doc_id: int, ticker: str, payload: str):
+        async with semaphore:
+            return await analyze_units_with_llm_async(doc_id, ticker, payload)
+    
+    results = await asyncio.gather(
+        *(_bounded(doc_id, ticker, payload) for doc_id, (ticker, payload) in tasks.items()),
+        return_exceptions=True
+    )
+    return dict(zip(tasks, results))
+
+def _suspicious_entry(stmt_analysis: Dict, figure: Dict) -> Dict:
+    """Review-queue entry for one low-confidence figure."""
+    return {
+        'statement_type': stmt_analysis['statement_type'],
+        'standard_mapping': stmt_analysis.get('standard_mapping', 'unknown'),
+        'label': figure['label'],
+        'value': figure['value'],
+        'representation': figure['representation'],
+        'reasoning': figure.get('reasoning', 'Low confidence from LLM'),
+    }
+
+def _iter_low_confidence(analysis: Dict) -> Iterator[Tuple[Dict, Dict]]:
+    """Lazily yield (statement_analysis, figure) for every low-confidence figure."""
     for stmt_analysis in analysis['statement_analyses']:
         for figure in stmt_analysis['figures']:
             if figure['confidence'] == 'low':
-                suspicious_figures.append({
-                    'statement_type': stmt_analysis['statement_type'],
-                    'standard_mapping': stmt_analysis.get('standard_mapping', 'unknown'),
-                    'label': figure['label'],
-                    'value': figure['value'],
-                    'representation': figure['representation'],
-                    'reasoning': figure.get('reasoning', 'Low confidence from LLM'),
-                })
-    
+                yield stmt_analysis, figure
+
+def _collect_suspicious_figures(analysis: Dict) -> List[Dict]:
+    """Build the review-queue entries for every low-confidence figure."""
+    return [_suspicious_entry(*pair) for pair in _iter_low_confidence(analysis)]
+
+def determine_review_requirement(analysis: Dict) -> Tuple[bool, List[Dict]]:
+    """
+    Determine if human review is required based on LLM analysis.
+    The suspicious-figure list is only built when review is required; the auto-approve
+    path just scans the lazy generator and allocates nothing.
+    """
     filing_requires_review = analysis['filing_analysis'].get('requires_human_review', False)
-    return len(suspicious_figures) > 0 or filing_requires_review, suspicious_figures
+    if not filing_requires_review and not any(True for _ in _iter_low_confidence(analysis)):
+        return False, []
+    return True, _collect_suspicious_figures(analysis)
 
 def apply_unit_normalization_to_data(staged_data: StagedNormalizedData, analysis: Dict) -> Dict:
     """
@@ -205,24 +263,36 @@ def apply_unit_normalization_to_data(staged_data: StagedNormalizedData, analysis
     # This is a placeholder for the actual transformation logic
     return {'llm_unit_analysis': analysis}
 
-def process_unit_normalization_discovery(doc_id: int, session) -> str:
+def prepare_unit_analysis(doc_id: int, session) -> Optional[Tuple[StagedNormalizedData, ParsedDocument, str]]:
     """
-    Process a single document through unit normalization discovery phase.
+    Load a document's staged record and parsed content and build its LLM payload.
+    Returns None if the document cannot be analyzed yet.
     """
     try:
-        staged_data = session.query(StagedNormalizedData).filter_by(doc_id=doc_id).one_or_none()
-        if not staged_data:
-            logger.error(f"Could not find staged data for doc_id {doc_id}")
-            return 'PENDING'
-
-        parsed_doc = session.get(ParsedDocument, doc_id)
-        if not parsed_doc:
-             logger.error(f"Could not find parsed document for doc_id {doc_id}")
-             return 'PENDING'
+        # One lookup each for the staged record and parsed document (raises if either is missing)
+        staged_data, original_content = get_filing_context_for_analysis(doc_id, session)
+        parsed_doc = session.get(ParsedDocument, doc_id)  # identity-map hit, no second SELECT
         
         logger.info(f"Processing unit discovery for {staged_data.ticker} {staged_data.fiscal_date} (doc_id: {doc_id})")
         
-        analysis = analyze_units_with_llm(doc_id, session)
+        statement_data = staged_data.normalized_data.get('statement_normalized_data', {})
+        analysis_payload = create_llm_analysis_payload(
+            statement_data, original_content, staged_data.ticker, staged_data.fiscal_date
+        )
+        return staged_data, parsed_doc, analysis_payload
+        
+    except Exception as e:
+        logger.error(f"Error preparing unit discovery for doc_id {doc_id}: {e}", exc_info=True)
+        session.rollback()
+        return None
+
+def persist_analysis_result(
+    doc_id: int, staged_data: StagedNormalizedData, parsed_doc: ParsedDocument, analysis: Dict, session
+) -> str:
+    """
+    Queue a document for human review or auto-approve it, based on its LLM unit analysis.
+    """
+    try:
         requires_review, suspicious_figures = determine_review_requirement(analysis)
         
         if requires_review:
@@ -241,10 +311,9 @@ def process_unit_normalization_discovery(doc_id: int, session) -> str:
         else:
             unit_normalized_data = apply_unit_normalization_to_data(staged_data, analysis)
             
-            # Use a dictionary to update JSONB
-            updated_data = staged_data.normalized_data.copy()
-            updated_data['unit_normalized_data'] = unit_normalized_data
-            staged_data.normalized_data = updated_data
+            # Mutate the loaded JSONB dict in place (no copy) and tell the ORM it changed
+            staged_data.normalized_data['unit_normalized_data'] = unit_normalized_data
+            flag_modified(staged_data, 'normalized_data')
             
             session.commit()
             logger.info(f"Auto-approved {staged_data.ticker} (high confidence)")
@@ -255,9 +324,25 @@ def process_unit_normalization_discovery(doc_id: int, session) -> str:
         session.rollback()
         return 'PENDING'
 
+def process_unit_normalization_discovery(doc_id: int, session) -> str:
+    """
+    Process a single document through unit normalization discovery phase.
+    """
+    prepared = prepare_unit_analysis(doc_id, session)
+    if prepared is None:
+        return 'PENDING'
+    staged_data, parsed_doc, analysis_payload = prepared
+    try:
+        analysis = analyze_units_with_llm(doc_id, staged_data.ticker, analysis_payload)
+    except Exception:
+        return 'PENDING'
+    return persist_analysis_result(doc_id, staged_data, parsed_doc, analysis, session)
+
 def run_unit_normalizer_discovery(allow_llm: bool):
     """
     Run the discovery phase of unit normalization.
+    Payloads are built and results persisted synchronously (one session); only the LLM
+    calls run concurrently, on one asyncio event loop with UNIT_MAX_WORKERS in flight.
     """
     if not allow_llm:
         logger.info("LLM calls disabled, skipping unit normalizer discovery")
@@ -277,11 +362,27 @@ def run_unit_normalizer_discovery(allow_llm: bool):
         logger.info(f"Found {len(doc_ids_to_process)} documents for unit analysis (out of {len(doc_ids)} total)")
         
         status_updates = {}
+        prepared = {}
         for doc_id in doc_ids_to_process:
-            status = process_unit_normalization_discovery(doc_id, session)
-            if status not in status_updates:
-                status_updates[status] = []
-            status_updates[status].append(doc_id)
+            task = prepare_unit_analysis(doc_id, session)
+            if task is None:
+                status_updates.setdefault('PENDING', []).append(doc_id)
+            else:
+                prepared[doc_id] = task
+        
+        if prepared:
+            analyses = asyncio.run(_analyze_all({
+                doc_id: (staged_data.ticker, payload)
+                for doc_id, (staged_data, _, payload) in prepared.items()
+            }))
+            # DB writes stay synchronous, after every LLM call has returned
+            for doc_id, analysis in analyses.items():
+                staged_data, parsed_doc, _ = prepared[doc_id]
+                if isinstance(analysis, BaseException):
+                    status = 'PENDING'  # already logged by analyze_units_with_llm_async
+                else:
+                    status = persist_analysis_result(doc_id, staged_data, parsed_doc, analysis, session)
+                status_updates.setdefault(status, []).append(doc_id)
         
         for status, doc_list in status_updates.items():
             if doc_list:
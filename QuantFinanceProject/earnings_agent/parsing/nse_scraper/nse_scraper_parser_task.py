@@ -57,85 +57,151 @@
 from __future__ import annotations
 
 import logging
+import multiprocessing
+import os
 import re
-from datetime import datetime
-from typing import Any, Dict, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
 
 from sqlalchemy import select, and_
-from sqlalchemy.orm import Session as SQLAlchemySession
 
 # Internal project imports
-from earnings_agent.storage.database import get_session, create_parsed_document
+from earnings_agent.storage.database import get_session, create_parsed_documents_bulk
 from earnings_agent.storage.models import RawDataAsset, ParsedDocument
 
 # --- Standard Logging Setup ---
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(module)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S',
-)
+# Root logging is configured by the entry point, not at import time
+logger = logging.getLogger(__name__)
+
+
+def configure_logging() -> None:
+    """Standard root logging setup for this task (CLI entry point and spawned parser workers)."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(module)s - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+    )
 
 # --- Configuration & Constants ---
 PARSER_VERSION = "2.1.0"
 SOURCE_TYPE_FILTER = "NSE_SCRAPER"
+INSERT_BATCH_SIZE = 500  # parsed documents upserted per executemany/commit
+STREAM_BATCH_SIZE = 200  # raw assets fetched per server-side cursor round trip
+PARSER_MAX_WORKERS = int(os.getenv("EARNINGS_PARSER_WORKERS", str(os.cpu_count() or 1)))
+PARSE_CHUNKSIZE = 32     # assets pickled per worker task, to amortize IPC
 
 DEFAULT_ROUNDING_LEVEL = "Lakhs"
 DEFAULT_ROUNDING_CONFIDENCE = "validated_by_profile"  # backed by cross-source checks
 DEFAULT_UNIT_INFERENCE_BASIS = "profile"  # how units were inferred for NSE source
 
 # Known key classes
-MONETARY_KEYS = {
+MONETARY_KEYS = frozenset({
     "re_net_sale", "re_total_inc", "re_oth_tot_exp", "re_rawmat_consump", "re_staff_cost",
     "re_depr_und_exp", "re_pur_trd_goods", "re_curr_tax", "re_deff_tax", "re_tax",
     "re_pro_loss_bef_tax", "re_pro_bef_int_n_excep", "re_con_pro_loss", "re_proloss_ord_act",
     "re_oth_exp", "re_oth_inc_new", "re_tot_com_ic", "re_oth_cmpr_incm", "re_tot_cmpr_incm",
     "re_pl_own_par", "re_tot_pl_nci", "re_share_associate", "re_net_mov_reg",
-}
+})
 
-PER_SHARE_KEYS = {
+PER_SHARE_KEYS = frozenset({
     "re_face_val", "re_basic_eps", "re_diluted_eps",
     "re_bsc_eps_bfr_exi", "re_dil_eps_bfr_exi",
     "re_basic_eps_for_cont_dic_opr", "re_dilut_eps_for_cont_dic_opr",
-}
+})
 
-PURE_RATIO_KEYS = {
+PURE_RATIO_KEYS = frozenset({
     "re_debt_eqt_rat", "re_debt_ser_cov", "re_int_ser_cov",
-}
+})
 
 # Admin/meta passthrough keys (kept as plain values)
-META_PASSTHROUGH_KEYS = {
+META_PASSTHROUGH_KEYS = frozenset({
     "re_seq_num", "seqnum",
     "re_remarks", "re_seg_remarks",
     "re_desc_note_fin", "re_desc_note_seg",
-}
+})
 
 # Lower-cased mirrors for robust checks
-MONETARY_KEYS_LC = {k.lower() for k in MONETARY_KEYS}
-PER_SHARE_KEYS_LC = {k.lower() for k in PER_SHARE_KEYS}
-PURE_RATIO_KEYS_LC = {k.lower() for k in PURE_RATIO_KEYS}
-META_PASSTHROUGH_KEYS_LC = {k.lower() for k in META_PASSTHROUGH_KEYS}
+MONETARY_KEYS_LC = frozenset(k.lower() for k in MONETARY_KEYS)
+PER_SHARE_KEYS_LC = frozenset(k.lower() for k in PER_SHARE_KEYS)
+PURE_RATIO_KEYS_LC = frozenset(k.lower() for k in PURE_RATIO_KEYS)
+META_PASSTHROUGH_KEYS_LC = frozenset(k.lower() for k in META_PASSTHROUGH_KEYS)
 
 # Placeholders to keep as plain strings
-PLACEHOLDER_STRINGS = {"", "-", "—", "NA", "N.A.", "na", "n.a."}
-
-# Parentheses negative like "(123.45)"
-PAREN_NUM = re.compile(r"^\(\s*([0-9]+(?:\.[0-9]+)?)\s*\)$")
+PLACEHOLDER_STRINGS = frozenset({"", "-", "—", "NA", "N.A.", "na", "n.a."})
 
 # Variations of seqnum
 SEQNUM_RE = re.compile(r'^re?_?seq_?num$', re.IGNORECASE)
 
+# Plain (optionally negative) decimal numbers like "-123.45"
+NUMERIC_RE = re.compile(r"^-?\d+(?:\.\d+)?$")
+
+# Range separator in "01-Apr-2024 To 31-Mar-2025"
+RANGE_TO_RE = re.compile(r"\b[Tt]o\b")
+
+# Class-invariant unit metadata for emit_numeric, built once; copied per fact, never mutated
+_NUMERIC_COMMON = {
+    "decimals": None,
+    # Explicitly mark that NSE units are inferred, not provided by source
+    "unit_inferred": True,
+    "unit_inference_basis": DEFAULT_UNIT_INFERENCE_BASIS,
+}
+NUMERIC_TEMPLATES: Dict[str, Dict[str, Any]] = {
+    "per_share": {
+        **_NUMERIC_COMMON,
+        "unitRef": "INRPerShare",
+        "unit_measure": "iso4217:INR/xbrli:shares",
+        "representation": "per_share",
+    },
+    "pure": {
+        **_NUMERIC_COMMON,
+        "unitRef": "pure",
+        "unit_measure": "xbrli:pure",
+        "representation": "ratio",
+    },
+    "monetary": {
+        **_NUMERIC_COMMON,
+        "unitRef": "INR",
+        "unit_measure": "iso4217:INR",
+        "assumed_decimals": -5,      # Lakhs
+        "assumed_scale": "Lakhs",
+        "representation": "currency",
+    },
+}
+
+# Zero spellings that NSE's template forces for out-of-range ratios
+ZERO_STRINGS = frozenset({"0", "0.0", "0.00"})
+
+# Key-name substrings for classify_key ("ratio"/"coverage" are already covered by "rat"/"cov")
+PER_SHARE_KEY_PARTS = ("eps", "face_val", "facevalue")
+PURE_RATIO_KEY_PARTS = ("rat", "cov")
+
 
 # --- Helper Functions ---
 
+# Lower-cased month abbreviations, matching strptime's case-insensitive %b
+_MONTH_MAP = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12,
+}
+
+
 def parse_date_dmy_mon(s: Optional[str]) -> Optional[str]:
     """Parse '31-Dec-2024' -> '2024-12-31'. Returns ISO date or None."""
     if not s:
         return None
-    s = s.strip()
+    # Hand-parsed fixed DD-Mon-YYYY format: much cheaper than strptime's regex/locale machinery
+    parts = s.strip().split("-")
+    if len(parts) != 3:
+        return None
+    d, m, y = parts
+    month = _MONTH_MAP.get(m.lower())
+    if month is None or not (d.isdigit() and len(d) <= 2 and y.isdigit() and len(y) == 4):
+        return None
     try:
-        dt = datetime.strptime(s, "%d-%b-%Y")
-        return dt.date().isoformat()
-    except Exception:
+        return date(int(y), month, int(d)).isoformat()  # still rejects e.g. 31-Feb
+    except ValueError:
         return None
 
 
@@ -143,7 +209,7 @@ def parse_range_dmy_mon(s: Optional[str]) -> Optional[Tuple[str, str]]:
     """Parse '01-Apr-2024 To 31-Mar-2025' -> ('2024-04-01', '2025-03-31') or None."""
     if not s:
         return None
-    parts = re.split(r"\b[Tt]o\b", s)
+    parts = RANGE_TO_RE.split(s)
     if len(parts) != 2:
         return None
     start_raw = parts[0].strip()
@@ -156,18 +222,60 @@ def parse_range_dmy_mon(s: Optional[str]) -> Optional[Tuple[str, str]]:
 
 
 def is_numeric_string(s: str) -> bool:
-    return bool(re.match(r"^-?\d+(\.\d+)?$", s.strip()))
+    return NUMERIC_RE.match(s.strip()) is not None
 
 
-def classify_key(key: str, sval: str) -> str:
-    """Return 'monetary' | 'per_share' | 'pure'."""
-    kl = (key or "").strip().lower()
-    if kl in PER_SHARE_KEYS_LC or re.search(r"(eps|face_val|facevalue)", kl):
+def _is_decimal_number(s: str, ascii_only: bool = False) -> bool:
+    """True for 'digits' or 'digits.digits' (no sign), checked with str builtins rather than a regex."""
+    int_part, dot, frac = s.partition(".")
+    if not int_part.isdecimal() or (dot and not frac.isdecimal()):
+        return False
+    return s.isascii() if ascii_only else True
+
+
+def _parse_numeric_token(s: str) -> Tuple[Optional[str], bool]:
+    """
+    Single hand-written scan for numeric facts, including parentheses negatives.
+    Returns (value, was_parenthesized):
+      "(123.45)" -> ("-123.45", True); "-12.5" -> ("-12.5", False) (value passed through
+      unstripped, as before); anything non-numeric -> (None, False).
+    """
+    t = s.strip()
+    if len(t) >= 2 and t[0] == "(" and t[-1] == ")":
+        inner = t[1:-1].strip()
+        if _is_decimal_number(inner, ascii_only=True):  # parenthesized form: ASCII digits only
+            return "-" + inner, True
+        return None, False
+    if _is_decimal_number(t[1:] if t.startswith("-") else t):
+        return s, False
+    return None, False
+
+
+@lru_cache(maxsize=256)
+def _classify_key_static(kl: str) -> Optional[str]:
+    """Key-only part of classify_key (memoized: the set of NSE keys is small); None if undecided."""
+    if kl in PER_SHARE_KEYS_LC or any(p in kl for p in PER_SHARE_KEY_PARTS):
         return "per_share"
-    if kl in PURE_RATIO_KEYS_LC or re.search(r"(rat|ratio|cov|coverage)", kl):
+    if kl in PURE_RATIO_KEYS_LC or any(p in kl for p in PURE_RATIO_KEY_PARTS):
         return "pure"
     if kl in MONETARY_KEYS_LC:
         return "monetary"
+    return None
+
+
+@lru_cache(maxsize=512)
+def _key_kind(key: str) -> str:
+    """'meta' for admin/seqnum passthrough keys, else 'data' (memoized, so SEQNUM_RE runs once per distinct key)."""
+    if key.strip().lower() in META_PASSTHROUGH_KEYS_LC or SEQNUM_RE.match(key):
+        return "meta"
+    return "data"
+
+
+def classify_key(key: str, sval: str) -> str:
+    """Return 'monetary' | 'per_share' | 'pure'."""
+    klass = _classify_key_static((key or "").strip().lower())
+    if klass:
+        return klass
     # heuristic: if numeric and small magnitude + decimals => pure
     if is_numeric_string(sval):
         try:
@@ -182,55 +290,29 @@ def classify_key(key: str, sval: str) -> str:
 def emit_numeric(key: str, sval: str, context_ref: str, forced_zero_ratio: bool = False) -> Dict[str, Any]:
     """Build the enriched numeric object with unit metadata."""
     klass = classify_key(key, sval)
-    out: Dict[str, Any] = {
-        "value": sval,
-        "contextRef": context_ref,
-        "decimals": None,
-        # Explicitly mark that NSE units are inferred, not provided by source
-        "unit_inferred": True,
-        "unit_inference_basis": DEFAULT_UNIT_INFERENCE_BASIS,
-    }
-
-    if klass == "per_share":
-        out.update({
-            "unitRef": "INRPerShare",
-            "unit_measure": "iso4217:INR/xbrli:shares",
-            "representation": "per_share",
-        })
-    elif klass == "pure":
-        out.update({
-            "unitRef": "pure",
-            "unit_measure": "xbrli:pure",
-            "representation": "ratio",
-        })
-        if forced_zero_ratio and sval in {"0", "0.0", "0.00"}:
-            out["reported_zero_due_to_template_limit"] = True
-    else:  # monetary
-        out.update({
-            "unitRef": "INR",
-            "unit_measure": "iso4217:INR",
-            "assumed_decimals": -5,      # Lakhs
-            "assumed_scale": "Lakhs",
-            "representation": "currency",
-        })
+    out: Dict[str, Any] = {"value": sval, "contextRef": context_ref, **NUMERIC_TEMPLATES[klass]}
+    if klass == "pure" and forced_zero_ratio and sval in ZERO_STRINGS:
+        out["reported_zero_due_to_template_limit"] = True
     return out
 
 
 # --- Core Parsing Logic ---
 
-def parse_nse_api_asset(asset_id: int, session: SQLAlchemySession):
+def parse_nse_api_asset(asset_id: int, data_content: Optional[Dict[str, Any]]) -> Dict[str, Any]:
     """
     Processes a single raw data asset from the NSE API, emitting raw facts with
     unit metadata (no unit conversion).
+    `data_content` is the asset's RawDataAsset.data_content, streamed in by the caller.
+    Returns the ParsedDocument row (PARSED_OK or PARSING_ERROR); the caller persists it.
     """
-    logging.info(f"--- Processing Asset ID: {asset_id} ---")
+    logger.info("--- Processing Asset ID: %s ---", asset_id)
     try:
-        asset = session.get(RawDataAsset, asset_id)
-        if not asset or not asset.data_content:
+        if not data_content:
             raise ValueError(f"Asset {asset_id} is invalid or has no data_content.")
 
-        data = asset.data_content or {}
-        rd2 = data.get("resultsData2") or data.get("resultsData") or {}
+        data = data_content
+        # resultsData2 is present for nearly every filing; the fallback lookup only runs without it
+        rd2 = data.get("resultsData2") or data.get("resultsData")
         if not rd2:
             raise ValueError("No financial results found in 'resultsData2' or 'resultsData'.")
 
@@ -256,6 +338,9 @@ def parse_nse_api_asset(asset_id: int, session: SQLAlchemySession):
 
         enriched: Dict[str, Any] = {}
 
+        # Pass 1: bucket facts by kind (nulls and non-string leftovers are final as-is)
+        meta_items: List[Tuple[str, Any]] = []
+        str_items: List[Tuple[str, str]] = []
         for key, sval in rd2.items():
             # normalize to string, preserve None
             if sval is None:
@@ -263,38 +348,34 @@ def parse_nse_api_asset(asset_id: int, session: SQLAlchemySession):
                 continue
             if isinstance(sval, (int, float)):
                 sval = str(sval)
+            if _key_kind(key or "") == "meta":
+                meta_items.append((key, sval))
+            elif isinstance(sval, str):
+                str_items.append((key, sval))
+            else:
+                enriched[key] = sval
 
-            kl = (key or "").strip().lower()
-
-            # passthrough for metadata/admin fields
-            if kl in META_PASSTHROUGH_KEYS_LC or SEQNUM_RE.match(key or ""):
-                # keep as plain value (unwrap dict if somehow present)
-                if isinstance(sval, dict):
-                    enriched[key] = sval.get("value") if "value" in sval else str(sval)
-                else:
-                    enriched[key] = sval
-                continue
+        # Pass 2: passthrough for metadata/admin fields, kept as plain values
+        for key, sval in meta_items:
+            # unwrap dict if somehow present
+            if isinstance(sval, dict):
+                enriched[key] = sval.get("value") if "value" in sval else str(sval)
+            else:
+                enriched[key] = sval
 
-            # placeholder strings remain plain
-            if isinstance(sval, str) and sval.strip() in PLACEHOLDER_STRINGS:
+        # Pass 3: string facts; placeholders stay plain, numerics (incl. "(123.45)") get unit metadata
+        for key, sval in str_items:
+            if sval.strip() in PLACEHOLDER_STRINGS:
                 enriched[key] = sval
                 continue
-
-            # handle parentheses negatives "(123.45)"
-            if isinstance(sval, str):
-                m = PAREN_NUM.match(sval.strip())
-                if m:
-                    norm = "-" + m.group(1)
-                    obj = emit_numeric(key, norm, context_ref, forced_zero_ratio=forced_zero_ratio)
-                    obj["original_value"] = sval
-                    enriched[key] = obj
-                    continue
-
-            # numeric?
-            if isinstance(sval, str) and is_numeric_string(sval):
-                enriched[key] = emit_numeric(key, sval, context_ref, forced_zero_ratio=forced_zero_ratio)
-            else:
+            norm, parenthesized = _parse_numeric_token(sval)
+            if norm is None:
                 enriched[key] = sval
+                continue
+            obj = emit_numeric(key, norm, context_ref, forced_zero_ratio=forced_zero_ratio)
+            if parenthesized:
+                obj["original_value"] = sval
+            enriched[key] = obj
 
         # Build final content
         content: Dict[str, Any] = {
@@ -315,19 +396,19 @@ def parse_nse_api_asset(asset_id: int, session: SQLAlchemySession):
             "parse_status": "PARSED_OK",
             "content": content,
         }
-        create_parsed_document(doc_data)
-        logging.info(f"✅ Successfully parsed and stored result for Asset ID: {asset_id}")
+        logger.info("✅ Successfully parsed Asset ID: %s", asset_id)
+        return doc_data
 
     except Exception as e:
-        logging.error(f"❌ An error occurred parsing Asset ID {asset_id}: {e}", exc_info=False)
+        logger.error("❌ An error occurred parsing Asset ID %s: %s", asset_id, e, exc_info=False)
         doc_data = {
             "asset_id": asset_id,
             "parser_version": PARSER_VERSION,
             "parse_status": "PARSING_ERROR",
             "error_details": str(e),
         }
-        create_parsed_document(doc_data)
-        logging.error(f"   Created PARSING_ERROR record for Asset ID: {asset_id}")
+        logger.error("   Created PARSING_ERROR record for Asset ID: %s", asset_id)
+        return doc_data
 
 
 # --- Main Batch Processing Logic ---
@@ -337,36 +418,56 @@ def run_parser_batch():
     Finds and processes all unprocessed NSE_SCRAPER assets in the database.
     This is the production-ready entry point for the task.
     """
-    logging.info(f"--- Starting NSE Parser Batch Run v{PARSER_VERSION} ---")
+    logger.info("--- Starting NSE Parser Batch Run v%s ---", PARSER_VERSION)
     session = get_session()
     try:
         # Only reprocess if this specific parser version hasn't run
         subquery = select(ParsedDocument.asset_id).where(ParsedDocument.parser_version == PARSER_VERSION)
 
-        stmt = select(RawDataAsset.asset_id).where(
+        # One streamed query for the id and payload of every pending asset (no per-asset
+        # session.get, and no columns the parser doesn't read)
+        stmt = select(RawDataAsset.asset_id, RawDataAsset.data_content).where(
             and_(
                 RawDataAsset.source_type == SOURCE_TYPE_FILTER,
                 RawDataAsset.asset_id.notin_(subquery),
             )
-        )
-        asset_ids_to_process = session.execute(stmt).scalars().all()
-
-        if not asset_ids_to_process:
-            logging.info("No new NSE API assets to process. Exiting.")
+        ).execution_options(yield_per=STREAM_BATCH_SIZE)
+
+        processed = 0
+        pending_docs = []
+        # Parsing is pure CPU with no DB access, so it fans out across processes; inserts stay
+        # on this process. "spawn" so workers don't inherit this process's open DB connections.
+        with ProcessPoolExecutor(
+            max_workers=PARSER_MAX_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+            initializer=configure_logging,  # spawned workers start with unconfigured logging
+        ) as executor:
+            for partition in session.execute(stmt).partitions():
+                asset_ids = [asset_id for asset_id, _ in partition]
+                contents = [data_content for _, data_content in partition]
+                processed += len(asset_ids)
+                try:
+                    for doc_data in executor.map(parse_nse_api_asset, asset_ids, contents, chunksize=PARSE_CHUNKSIZE):
+                        pending_docs.append(doc_data)
+                        if len(pending_docs) >= INSERT_BATCH_SIZE:
+                            create_parsed_documents_bulk(pending_docs)
+                            logger.info("Stored %s parsed documents.", len(pending_docs))
+                            pending_docs = []
+                except Exception as e:
+                    logger.critical("A critical error occurred in main loop for asset_ids %s: %s", asset_ids, e, exc_info=True)
+        if pending_docs:
+            create_parsed_documents_bulk(pending_docs)
+            logger.info("Stored %s parsed documents.", len(pending_docs))
+
+        if not processed:
+            logger.info("No new NSE API assets to process. Exiting.")
             return
+        logger.info("Processed %s unprocessed NSE assets.", processed)
 
-        logging.info(f"Found {len(asset_ids_to_process)} unprocessed NSE assets. Starting batch.")
-
-        for asset_id in asset_ids_to_process:
-            try:
-                parse_nse_api_asset(asset_id, session)
-            except Exception as e:
-                logging.critical(f"A critical error occurred in main loop for asset_id {asset_id}: {e}", exc_info=True)
-
-        logging.info("--- Batch run completed successfully. ---")
+        logger.info("--- Batch run completed successfully. ---")
     finally:
         session.close()
 
 
 if __name__ == '__main__':
+    configure_logging()
     run_parser_batch()
\ No newline at end of file
@@ -3,19 +3,28 @@
 import json
 import logging
 import os
+import string
 import sys
+import threading
 import time
 import concurrent.futures
 import yaml
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
 
 # --- Core library imports ---
 from google import genai
 from google.genai import types
 from google.oauth2 import service_account
 from sqlalchemy.orm import Session as SQLAlchemySession
-from sqlalchemy import select, update
+from sqlalchemy import select, update, func, literal, literal_column
+from sqlalchemy.dialects.postgresql import JSONB
+
+try:
+    import orjson
+except ImportError:  # orjson is an optional faster encoder/decoder
+    orjson = None
 
 
 # --- Project Imports ---
@@ -23,6 +32,7 @@ project_root = Path(__file__).resolve().parents[3]
 sys.path.append(str(project_root))
 
 from earnings_agent.storage.database import get_session
+from earnings_agent.llm.llm_cache import make_cache_key, get_cached_response, store_response
 from earnings_agent.storage.models import ParsedDocument, RawDataAsset, JobAssetLink, IngestionJob, CompanyMaster, Classification
 
 # --- UPDATED: Import the new Pydantic models and revised prompt/config ---
@@ -32,13 +42,13 @@ from earnings_agent.parsing.pdf.pdf_extractor_config import (
     PRODUCTION_CONFIG,
     SYSTEM_INSTRUCTION,
     EXTRACTION_PROMPT_TEMPLATE,
-    ExtractionResponse,
-    NormalizedFigure
+    ExtractionResponse
 )
 
 # --- Configuration ---
 PARSER_VERSION = "v3.0-accuracy-upgrade" # Bumping version to reflect the major logic change
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(module)s - %(message)s')
+# Root logging is configured by the entry point (__main__ below, or the importing task)
+logger = logging.getLogger(__name__)
 
 # --- GCP Configuration ---
 GCP_PROJECT_ID = "pdf-extractor-467911"
@@ -49,14 +59,47 @@ PLAYBOOKS_DIR = project_root / "earnings_agent" / "playbooks"
 BANKING_PLAYBOOK_PATH = PLAYBOOKS_DIR / "sebi" / "metrics" / "sebi_banking.yml"
 LLM_MAX_RETRIES = 3
 LLM_INITIAL_BACKOFF = 5
-MAX_WORKERS = 1
+# Extraction is network-bound (one Vertex call per statement), so documents run on threads
+MAX_WORKERS = int(os.getenv("EARNINGS_EXTRACTOR_WORKERS", "8"))
+# Cap on in-flight generate_content calls across all workers, to stay inside Vertex quota
+LLM_MAX_CONCURRENCY = int(os.getenv("EARNINGS_EXTRACTOR_LLM_CONCURRENCY", "4"))
+_LLM_SLOTS = threading.Semaphore(LLM_MAX_CONCURRENCY)
+# Statements of one document extracted concurrently (a filing has at most six)
+STATEMENT_WORKERS = int(os.getenv("EARNINGS_EXTRACTOR_STATEMENT_WORKERS", "6"))
+# Response schema and generation config shape the output too, so they are part of the LLM cache key
+_CACHE_KEY_SCHEMA = json.dumps(ExtractionResponse.model_json_schema(), sort_keys=True)
+_CACHE_KEY_CONFIG = repr(sorted(PRODUCTION_CONFIG.items()))
+
+try:
+    _YAML_LOADER = yaml.CSafeLoader
+except AttributeError:  # PyYAML built without libyaml
+    _YAML_LOADER = yaml.SafeLoader
+
+def _loads_json(text: str) -> Any:
+    """Decode JSON with orjson when available (both decoders raise ValueError subclasses)."""
+    return orjson.loads(text) if orjson else json.loads(text)
+
+def _has_extracted_values(llm_data: Dict[str, Any]) -> bool:
+    """True if the extraction response carries at least one non-null figure."""
+    return any(fig.get('value') is not None for fig in llm_data.get('normalized_figures', []))
+
+def _dumps_indented(obj: Any) -> str:
+    """Pretty-print (indent=2, non-ASCII kept) with orjson when available, else the stdlib."""
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+    return json.dumps(obj, indent=2, ensure_ascii=False)
 
 # ==============================================================================
 # --- NEW: ALL LLM-RELATED HELPER FUNCTIONS ARE FROM YOUR NEW SCRIPT ---
 # ==============================================================================
 
+@lru_cache(maxsize=1)
 def _get_gemini_client():
-    """Initializes and returns a production-ready Gemini client."""
+    """
+    Initializes and returns a production-ready Gemini client.
+    Built once per process and shared by all extraction threads (genai.Client is thread-safe);
+    failures are not cached, so a later call retries.
+    """
     try:
         credentials_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS", "/app/gcp-credentials.json")
         if not os.path.exists(credentials_path):
@@ -68,11 +111,12 @@ def _get_gemini_client():
         )
         return genai.Client(vertexai=True, project=GCP_PROJECT_ID, location=GCP_LOCATION, credentials=credentials)
     except Exception as e:
-        logging.error(f"Fatal error initializing Gemini client: {e}", exc_info=True)
+        logger.error("Fatal error initializing Gemini client: %s", e, exc_info=True)
         raise
 
+@lru_cache(maxsize=32)
 def generate_few_shot_examples(period: str) -> str:
-    """Creates a string of rich, few-shot examples to guide the LLM."""
+    """Creates a string of rich, few-shot examples to guide the LLM (cached: one build per filing period)."""
     
     example_1_desc = f"""
 **Example 1: Column Selection, Negative Values, and Footnotes**
@@ -122,32 +166,64 @@ You would find the column for '{period}' and update the template as follows:
 """
     return f"{example_1_desc}```json\n{example_1_code}```\n"
 
+# EXTRACTION_PROMPT_TEMPLATE split once into (literal, field_name) pairs, so building a
+# prompt is a join instead of a str.format parse of the multi-KB template on every call
+_PROMPT_PARTS = tuple(
+    (literal, field_name) for literal, field_name, _, _ in string.Formatter().parse(EXTRACTION_PROMPT_TEMPLATE)
+)
+
+def _build_extraction_prompt(**fields: str) -> str:
+    """Equivalent to EXTRACTION_PROMPT_TEMPLATE.format(**fields) for its plain {name} placeholders."""
+    return "".join(literal + (fields[name] if name else "") for literal, name in _PROMPT_PARTS)
+
+@lru_cache(maxsize=16)
+def _template_json_for(ordered_ids: tuple) -> str:
+    """
+    Serialized "Fill-in-the-Blank" template for a playbook's leaf IDs. Byte-identical to
+    ExtractionResponse(...).model_dump_json(indent=2) with every figure missing, built with
+    plain dicts instead of constructing one Pydantic model per ID.
+    """
+    template = {
+        "normalized_figures": [
+            {
+                "playbook_id": pid, "raw_label": "Missing in Filing", "value": None, "confidence": "high",
+                "representation": None, "currency_context": None, "unit_scale": None, "ratio_context": None
+            }
+            for pid in ordered_ids
+        ],
+        "unmapped_from_pdf": []
+    }
+    return _dumps_indented(template)
+
 def _call_extraction_llm(
     client: genai.Client, pdf_bytes: bytes, statement_type: str,
     playbook_structure: Dict[str, Any], filing_period: str
 ) -> str:
     """Calls the Gemini API using the "Fill-in-the-Blank" method."""
-    logging.info(f"      -> Preparing 'Fill-in-the-Blank' call for {statement_type}...")
+    logger.info("      -> Preparing 'Fill-in-the-Blank' call for %s...", statement_type)
 
     # 1. Create the JSON template to be filled
-    template_figures = []
-    for pid in playbook_structure['ordered_ids']:
-        template_figures.append(
-            NormalizedFigure(playbook_id=pid, raw_label="Missing in Filing", value=None, confidence="high",
-                             representation=None, currency_context=None, unit_scale=None, ratio_context=None))
-    response_template = ExtractionResponse(normalized_figures=template_figures, unmapped_from_pdf=[])
-    template_json_str = response_template.model_dump_json(indent=2)
+    template_json_str = _template_json_for(tuple(playbook_structure['ordered_ids']))
 
     # 2. Build the final prompt
-    prompt = EXTRACTION_PROMPT_TEMPLATE
     few_shot_examples = generate_few_shot_examples(filing_period)
-    final_prompt = prompt.format(
+    final_prompt = _build_extraction_prompt(
         period=filing_period,
-        hierarchical_playbook_json=json.dumps(playbook_structure['hierarchy'], indent=2),
+        hierarchical_playbook_json=playbook_structure['hierarchy_json'],
         json_template_placeholder=template_json_str,
         few_shot_examples_placeholder=few_shot_examples
     )
 
+    # Same PDF + prompt + schema + config + model + parser version => same request; reuse an earlier validated response
+    cache_key = make_cache_key(
+        pdf_bytes, final_prompt, SYSTEM_INSTRUCTION, _CACHE_KEY_SCHEMA, _CACHE_KEY_CONFIG,
+        PRODUCTION_MODEL, PARSER_VERSION
+    )
+    cached_text = get_cached_response(cache_key)
+    if cached_text is not None:
+        logger.info("      -> Using cached LLM response for %s.", statement_type)
+        return cached_text
+
     # 3. Configure the API call with the Pydantic schema
     config = {**PRODUCTION_CONFIG}
     config['response_schema'] = ExtractionResponse
@@ -155,49 +231,76 @@ def _call_extraction_llm(
     # 4. Make the call with retry logic
     for attempt in range(LLM_MAX_RETRIES):
         try:
-            response = client.models.generate_content(
-                model=PRODUCTION_MODEL,
-                contents=[
-                    final_prompt,
-                    types.Part.from_bytes(data=pdf_bytes, mime_type="application/pdf"),
-                ],
-                config=types.GenerateContentConfig(**config),
-            )
+            # Hold a slot only for the request itself, not for the backoff sleep
+            with _LLM_SLOTS:
+                response = client.models.generate_content(
+                    model=PRODUCTION_MODEL,
+                    contents=[
+                        final_prompt,
+                        types.Part.from_bytes(data=pdf_bytes, mime_type="application/pdf"),
+                    ],
+                    config=types.GenerateContentConfig(**config),
+                )
             # The genai library automatically parses the response into the Pydantic object
-            return response.text
+            response_text = response.text
+            # Only cache responses with data, so an EXTRACTION_ERROR rerun still asks the model again
+            try:
+                if response_text and _has_extracted_values(_loads_json(response_text)):
+                    store_response(cache_key, response_text)
+            except ValueError:
+                pass
+            return response_text
         except Exception as e:
-            logging.warning(f"LLM call failed on attempt {attempt + 1}/{LLM_MAX_RETRIES}: {e}")
+            logger.warning("LLM call failed on attempt %s/%s: %s", attempt + 1, LLM_MAX_RETRIES, e)
             if attempt + 1 == LLM_MAX_RETRIES:
                 raise
             time.sleep(LLM_INITIAL_BACKOFF * (2 ** attempt))
     raise RuntimeError("LLM call failed after all retry attempts.")
 
-def get_playbook_structure(playbook_path: Path, statement_type: str) -> Dict[str, Any]:
-    """Loads playbook structure, filtering for only extractable leaf nodes."""
-    def _get_leaf_ids_recursive(nodes):
-        ids = []
-        for node in nodes:
-            if not node.get('children'):
-                if node.get('extractable', True): # The filtering logic
-                    ids.append(node['id'])
-            else:
-                ids.extend(_get_leaf_ids_recursive(node.get('children', [])))
-        return ids
-
-    with open(playbook_path, "r", encoding="utf-8") as f:
-        playbook = list(yaml.safe_load_all(f))
+def _get_leaf_ids(nodes) -> List[str]:
+    """Ordered IDs of the extractable leaf nodes under `nodes` (iterative pre-order walk)."""
+    ids = []
+    stack = list(reversed(nodes))
+    while stack:
+        node = stack.pop()
+        children = node.get('children')
+        if not children:
+            if node.get('extractable', True): # The filtering logic
+                ids.append(node['id'])
+        else:
+            stack.extend(reversed(children))  # reversed so children pop in document order
+    return ids
 
+@lru_cache(maxsize=32)
+def _get_playbook_cached(path_str: str, mtime: float, statement_type: str) -> Dict[str, Any]:
+    """Parse the playbook and walk its tree once per (file version, statement type)."""
     doc_key_map = {'pnl': 'pnl', 'balance_sheet': 'balance_sheet', 'cash_flow': 'cash_flow_indirect'}
     target_key = next((v for k, v in doc_key_map.items() if k in statement_type), None)
     if not target_key: raise ValueError(f"Unknown statement type: {statement_type}")
 
-    for doc in playbook:
-        if doc and doc.get("statement", "").startswith(target_key):
-            nodes = doc.get("nodes", [])
-            return {'hierarchy': nodes, 'ordered_ids': _get_leaf_ids_recursive(nodes)}
+    with open(path_str, "r", encoding="utf-8") as f:
+        for doc in yaml.load_all(f, Loader=_YAML_LOADER):
+            if doc and doc.get("statement", "").startswith(target_key):
+                nodes = doc.get("nodes", [])
+                return {
+                    'hierarchy': nodes,
+                    # Pretty-printed once here rather than on every extraction prompt
+                    'hierarchy_json': _dumps_indented(nodes),
+                    'ordered_ids': _get_leaf_ids(nodes)
+                }
 
     raise ValueError(f"No playbook found for statement type: {statement_type}")
 
+def get_playbook_structure(playbook_path: Path, statement_type: str) -> Dict[str, Any]:
+    """
+    Loads playbook structure, filtering for only extractable leaf nodes.
+    Cached by file mtime, so edits to the playbook are picked up; the returned dict is shared: do not mutate.
+    """
+    return _get_playbook_cached(str(playbook_path), os.path.getmtime(playbook_path), statement_type)
+
+# Fixed English month abbreviations (index = month number), independent of locale
+_MONTH_ABBR = ("", "Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
 def get_filing_metadata_for_extraction(session: SQLAlchemySession, asset_id: int) -> Dict[str, Any]:
     """Helper to get ticker and period for a given asset_id."""
     stmt = select(IngestionJob.ticker, IngestionJob.fiscal_year, IngestionJob.quarter)\
@@ -205,22 +308,73 @@ def get_filing_metadata_for_extraction(session: SQLAlchemySession, asset_id: int
         .filter(JobAssetLink.asset_id == asset_id).limit(1)
     result = session.execute(stmt).first()
     if not result: raise ValueError(f"Could not find job metadata for asset_id {asset_id}")
+    return _format_filing_metadata(result.ticker, result.fiscal_year, result.quarter)
 
-    # Logic to create a human-readable period string like "31-Mar-2025"
+def _format_filing_metadata(ticker: str, fiscal_year: int, quarter: int) -> Dict[str, Any]:
+    """Build the metadata dict, with a human-readable period string like "31-Mar-2025"."""
     q_map = {1: (6, 30), 2: (9, 30), 3: (12, 31), 4: (3, 31)}
-    fy, q = result.fiscal_year, result.quarter
-    month, day = q_map[q]
-    year = fy if q <= 3 else fy + 1
-    period_str = f"{day:02d}-{time.strftime('%b', time.gmtime(month*2629746))}-{year}"
-    return {"ticker": result.ticker, "period": period_str}
+    month, day = q_map[quarter]
+    year = fiscal_year if quarter <= 3 else fiscal_year + 1
+    period_str = f"{day:02d}-{_MONTH_ABBR[month]}-{year}"
+    return {"ticker": ticker, "period": period_str}
+
+def get_filing_metadata_bulk(session: SQLAlchemySession, doc_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    """
+    Metadata for many documents in one joined query (doc_id -> metadata dict), so workers
+    don't each issue their own lookup. Documents with no job, or with metadata that cannot be
+    formatted, are absent from the result; their workers look it up (and fail) individually.
+    """
+    if not doc_ids: return {}
+    stmt = select(ParsedDocument.doc_id, IngestionJob.ticker, IngestionJob.fiscal_year, IngestionJob.quarter)\
+        .join(JobAssetLink, JobAssetLink.asset_id == ParsedDocument.asset_id)\
+        .join(IngestionJob, IngestionJob.job_id == JobAssetLink.job_id)\
+        .where(ParsedDocument.doc_id.in_(doc_ids))\
+        .order_by(ParsedDocument.doc_id, IngestionJob.job_id)
+    metadata_by_doc = {}
+    for row in session.execute(stmt):
+        if row.doc_id in metadata_by_doc:  # first job per document wins
+            continue
+        try:
+            metadata_by_doc[row.doc_id] = _format_filing_metadata(row.ticker, row.fiscal_year, row.quarter)
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning("Bad filing metadata for doc_id %s (quarter=%r, fiscal_year=%r): %s",
+                           row.doc_id, row.quarter, row.fiscal_year, e)
+    return metadata_by_doc
 
 
 # ==============================================================================
 # --- THE ORIGINAL WORKFLOW LOGIC, NOW USING THE NEW HELPERS ---
 # ==============================================================================
 
-def process_single_document_extraction(doc_id: int, session: SQLAlchemySession):
-    """Processes extraction for a single document with the new accuracy-focused logic."""
+def _extract_statement(
+    client: genai.Client, statement_type: str, relative_path: str, filing_period: str
+) -> Tuple[str, Optional[Dict[str, Any]], Optional[str]]:
+    """Extract one isolated statement. Returns (statement_type, llm_data, None) or (statement_type, None, error)."""
+    logger.info("  -> Extracting statement: %s", statement_type)
+    full_path = project_root / relative_path
+    try:
+        # --- NEW: This block now calls the new, more powerful LLM functions ---
+        with open(full_path, "rb") as f: pdf_bytes = f.read()
+        playbook_structure = get_playbook_structure(BANKING_PLAYBOOK_PATH, statement_type)
+        response_text = _call_extraction_llm(client, pdf_bytes, statement_type, playbook_structure, filing_period)
+        llm_data = _loads_json(response_text)
+
+        if not _has_extracted_values(llm_data):
+            raise ValueError("LLM returned a valid structure but with no extracted financial data.")
+
+        logger.info("    âœ… Successfully extracted %s with data.", statement_type)
+        return statement_type, llm_data, None
+    except Exception as e:
+        logger.error("    âŒ Failed to extract %s: %s", statement_type, e, exc_info=True)
+        return statement_type, None, str(e)
+
+def process_single_document_extraction(
+    doc_id: int, session: SQLAlchemySession, metadata: Optional[Dict[str, Any]] = None
+):
+    """
+    Processes extraction for a single document with the new accuracy-focused logic.
+    `metadata` is the prefetched filing metadata; looked up here when not supplied.
+    """
     final_extraction_data, failed_statements = {}, []
     try:
         # --- This part is from your original script ---
@@ -230,48 +384,51 @@ def process_single_document_extraction(doc_id: int, session: SQLAlchemySession):
         isolated_paths = parsed_doc.content.get("isolated_statement_paths", {})
         if not isolated_paths:
             raise ValueError("No isolated statement paths found.")
-        logging.info(f"Processing extraction for doc_id {doc_id} with {len(isolated_paths)} statements.")
+        logger.info("Processing extraction for doc_id %s with %s statements.", doc_id, len(isolated_paths))
 
         # --- NEW: Get filing metadata required for the prompt and initialize client ---
-        metadata = get_filing_metadata_for_extraction(session, parsed_doc.asset_id)
+        if metadata is None:
+            metadata = get_filing_metadata_for_extraction(session, parsed_doc.asset_id)
         filing_period = metadata['period']
+        # End the read transaction so the pooled connection goes back to the pool for the
+        # (minutes-long) LLM calls below; the session checks one out again for the final update
+        session.commit()
         client = _get_gemini_client()
 
-        for statement_type, relative_path in isolated_paths.items():
-            logging.info(f"  -> Extracting statement: {statement_type}")
-            full_path = project_root / relative_path
-
-            try:
-                # --- NEW: This block now calls the new, more powerful LLM functions ---
-                with open(full_path, "rb") as f: pdf_bytes = f.read()
-                playbook_structure = get_playbook_structure(BANKING_PLAYBOOK_PATH, statement_type)
-                response_text = _call_extraction_llm(client, pdf_bytes, statement_type, playbook_structure, filing_period)
-                llm_data = json.loads(response_text)
-
-                if not any(fig.get('value') is not None for fig in llm_data.get('normalized_figures', [])):
-                    raise ValueError("LLM returned a valid structure but with no extracted financial data.")
+        # Statements are independent network-bound calls, so fan them out; the global LLM
+        # semaphore still caps how many are in flight across all documents
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(len(isolated_paths), STATEMENT_WORKERS)
+        ) as statement_pool:
+            results = list(statement_pool.map(
+                lambda item: _extract_statement(client, item[0], item[1], filing_period),
+                isolated_paths.items()
+            ))
 
+        for statement_type, llm_data, error in results:
+            if error is None:
                 final_extraction_data[statement_type] = llm_data
-                logging.info(f"    âœ… Successfully extracted {statement_type} with data.")
-            except Exception as e:
-                logging.error(f"    âŒ Failed to extract {statement_type}: {e}", exc_info=True)
-                final_extraction_data[statement_type] = {"error": str(e)}
-                failed_statements.append(f"{statement_type}: {str(e)}")
+            else:
+                final_extraction_data[statement_type] = {"error": error}
+                failed_statements.append(f"{statement_type}: {error}")
 
         # --- This database update logic is from your original script, preserved perfectly ---
         if not failed_statements:
             final_status, error_details = 'EXTRACTION_SUCCESS', None
-            logging.info(f"âœ… All {len(isolated_paths)} statements extracted successfully for doc_id {doc_id}.")
+            logger.info("âœ… All %s statements extracted successfully for doc_id %s.", len(isolated_paths), doc_id)
         else:
             final_status = 'EXTRACTION_ERROR'
             error_details = f"Failed {len(failed_statements)}/{len(isolated_paths)} statements: {'; '.join(failed_statements)}"
-            logging.error(f"âŒ Extraction failed for doc_id {doc_id}: {error_details}")
-
-        new_content = parsed_doc.content.copy()
-        new_content['llm_call_2_extraction'] = final_extraction_data
+            logger.error("âŒ Extraction failed for doc_id %s: %s", doc_id, error_details)
 
+        # Patch just the extraction key server-side instead of copying and re-sending the whole
+        # content blob (which includes the isolation output)
         update_stmt = update(ParsedDocument).where(ParsedDocument.doc_id == doc_id).values(
-            content=new_content,
+            content=func.jsonb_set(
+                ParsedDocument.content,
+                literal_column("'{llm_call_2_extraction}'::text[]"),
+                literal(final_extraction_data, JSONB)
+            ),
             parse_status=final_status,
             error_details=error_details,
             parser_version=PARSER_VERSION
@@ -280,7 +437,7 @@ def process_single_document_extraction(doc_id: int, session: SQLAlchemySession):
         session.commit()
 
     except Exception as e:
-        logging.error(f"âŒ Major error processing doc_id {doc_id}: {e}", exc_info=True)
+        logger.error("âŒ Major error processing doc_id %s: %s", doc_id, e, exc_info=True)
         session.rollback()
         # Attempt a final update to mark the job as failed
         with get_session() as error_session:
@@ -302,39 +459,63 @@ def get_banking_doc_ids(session: SQLAlchemySession, all_doc_ids: List[int]) -> L
         .join(Classification, CompanyMaster.classification_id == Classification.id)\
         .where(Classification.industry_name == 'Banks')
     banking_doc_ids = session.execute(banking_docs_query).scalars().all()
-    logging.info(f"Filtered out {len(all_doc_ids) - len(banking_doc_ids)} non-banking companies. Processing {len(banking_doc_ids)} banking documents.")
+    logger.info("Filtered out %s non-banking companies. Processing %s banking documents.", len(all_doc_ids) - len(banking_doc_ids), len(banking_doc_ids))
     return banking_doc_ids
 
-def _execute_extraction_for_worker(doc_id: int):
-    """Worker function for multiprocessing."""
+def _execute_extraction_for_worker(doc_id: int, metadata: Optional[Dict[str, Any]] = None):
+    """Worker function for the extraction thread pool; each document gets its own session."""
     try:
         with get_session() as db_session:
-            process_single_document_extraction(doc_id, db_session)
+            process_single_document_extraction(doc_id, db_session, metadata)
     except Exception as e:
-        logging.error(f"Worker process for doc_id {doc_id} crashed: {e}", exc_info=True)
+        logger.error("Worker for doc_id %s crashed: %s", doc_id, e, exc_info=True)
+
+def get_pending_extraction_doc_ids(session: SQLAlchemySession, asset_ids: Optional[List[int]] = None) -> List[int]:
+    """
+    Banking documents that have been isolated but not yet successfully extracted by this version,
+    optionally restricted to the given assets.
+    """
+    stmt = select(ParsedDocument.doc_id).where(
+        ParsedDocument.parse_status.in_(['ISOLATION_SUCCESS', 'EXTRACTION_ERROR']),
+        ParsedDocument.parser_version != PARSER_VERSION
+    )
+    if asset_ids is not None:
+        stmt = stmt.where(ParsedDocument.asset_id.in_(asset_ids))
+    all_doc_ids = session.execute(stmt).scalars().all()
+    return get_banking_doc_ids(session, all_doc_ids)
+
+def submit_extractions(
+    executor: concurrent.futures.Executor, doc_ids: List[int], metadata_by_doc: Dict[int, Dict[str, Any]]
+) -> List[concurrent.futures.Future]:
+    """Submit one extraction job per document, with its prefetched metadata."""
+    return [
+        executor.submit(_execute_extraction_for_worker, doc_id, metadata_by_doc.get(doc_id))
+        for doc_id in doc_ids
+    ]
 
 def run_extractor_batch():
     """Runs extraction batch with banking industry filtering."""
-    logging.info(f"--- Starting PDF Extractor Batch Run v{PARSER_VERSION} ---")
+    logger.info("--- Starting PDF Extractor Batch Run v%s ---", PARSER_VERSION)
 
     with get_session() as session:
-        # Find documents that have been isolated but not yet successfully extracted by this version
-        stmt = select(ParsedDocument.doc_id).where(
-            ParsedDocument.parse_status.in_(['ISOLATION_SUCCESS', 'EXTRACTION_ERROR']),
-            ParsedDocument.parser_version != PARSER_VERSION
-        )
-        all_doc_ids = session.execute(stmt).scalars().all()
-        banking_doc_ids = get_banking_doc_ids(session, all_doc_ids)
+        banking_doc_ids = get_pending_extraction_doc_ids(session)
+        metadata_by_doc = get_filing_metadata_bulk(session, banking_doc_ids)
 
     if not banking_doc_ids:
-        logging.info("No banking documents pending extraction for this version.")
+        logger.info("No banking documents pending extraction for this version.")
         return
 
-    logging.info(f"Found {len(banking_doc_ids)} banking documents for extraction with {MAX_WORKERS} workers.")
-    with concurrent.futures.ProcessPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        list(executor.map(_execute_extraction_for_worker, banking_doc_ids))
+    logger.info("Found %s banking documents for extraction with %s workers (%s concurrent LLM calls).",
+                len(banking_doc_ids), MAX_WORKERS, LLM_MAX_CONCURRENCY)
+    # The session factory was initialised above on this thread, so workers only open sessions
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        list(executor.map(
+            _execute_extraction_for_worker,
+            banking_doc_ids, [metadata_by_doc.get(doc_id) for doc_id in banking_doc_ids]
+        ))
 
-    logging.info("--- Extractor batch run completed. ---")
+    logger.info("--- Extractor batch run completed. ---")
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(module)s - %(message)s')
     run_extractor_batch()
\ No newline at end of file
@@ -1,11 +1,13 @@
+import io
 import json
 import logging
 import os
 import sys
 import time
 import concurrent.futures
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 # Google GenAI SDK imports
 from google import genai
@@ -14,12 +16,23 @@ from google.auth import default
 from google.oauth2 import service_account
 from PyPDF2 import PdfReader, PdfWriter
 
+try:
+    import pikepdf
+except ImportError:  # pikepdf is an optional faster (qpdf-backed) page splitter
+    pikepdf = None
+
+try:
+    import pypdfium2
+except ImportError:  # pypdfium2 is optional: used to rasterize very large filings for the LLM
+    pypdfium2 = None
+
 # --- Project Imports ---
 # FIX: Corrected path to ensure consistency across the project.
 project_root = Path(__file__).resolve().parents[3]
 sys.path.append(str(project_root))
 
 from earnings_agent.storage.database import get_session, create_parsed_document
+from earnings_agent.llm.llm_cache import make_cache_key, get_cached_response, store_response
 from earnings_agent.storage.models import RawDataAsset, ParsedDocument, IngestionJob, JobAssetLink
 from sqlalchemy.orm import Session as SQLAlchemySession
 from sqlalchemy import select
@@ -44,9 +57,28 @@ STATEMENT_SCHEMA = types.Schema(
     },
     required=['statement_name', 'start_page', 'end_page', 'mapping']
 )
+ISOLATION_CONFIG = types.GenerateContentConfig(
+    response_mime_type="application/json",
+    temperature=0.0,
+    response_schema=types.Schema(
+        type=types.Type.OBJECT,
+        properties={'statements_found': types.Schema(type=types.Type.ARRAY, items=STATEMENT_SCHEMA)},
+        required=['statements_found']
+    )
+)
+# The schema and generation config shape the response too, so they are part of the LLM cache key
+_CACHE_KEY_CONFIG = ISOLATION_CONFIG.model_dump_json(exclude_none=True)
 PROCESSED_PDF_DIR = project_root / "earnings_agent" / "storage" / "data" / "processed" / "isolated_pdf"
 
+# --- LLM Upload Size ---
+# Filings still above this size after lossless recompression are sent to the layout LLM as one
+# JPEG per page (page count unchanged, so the returned page numbers still index the original)
+LLM_PDF_RASTER_THRESHOLD = 20 * 1024 * 1024
+LLM_PDF_RASTER_DPI = 150
+LLM_PDF_JPEG_QUALITY = 75
+
 # --- Retry & Error Handling ---
+MAX_WORKERS = 1
 LLM_MAX_RETRIES = 3
 LLM_INITIAL_BACKOFF = 5
 
@@ -102,10 +134,12 @@ Map "Statement of Cash Flows" → `standalone_cash_flow` or `consolidated_cash_f
 
 # In pdf_isolator_task.py
 
-def _get_gemini_client():
+@lru_cache(maxsize=1)
+def _build_gemini_client(pid: int):
     """
-    FIX: Initializes and returns a NEW production-ready Gemini client.
-    This is now safe to be called from within each worker process.
+    Initializes and returns a production-ready Gemini client for process `pid`.
+    Keyed on the pid so a forked worker builds its own client instead of reusing the
+    parent's HTTP connections; within a process the client (and its pool) is reused.
     """
     try:
         credentials_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS", "/app/gcp-credentials.json")
@@ -117,7 +151,6 @@ def _get_gemini_client():
             scopes=['https://www.googleapis.com/auth/cloud-platform']
         )
         
-        # Create and return a NEW client instance every time.
         return genai.Client(
             vertexai=True,
             project=GCP_PROJECT_ID,
@@ -128,24 +161,20 @@ def _get_gemini_client():
     except Exception as e:
         logging.error(f"Fatal error initializing Gemini client: {e}", exc_info=True)
         raise
+
+def _get_gemini_client():
+    """Return this process's cached Gemini client."""
+    return _build_gemini_client(os.getpid())
+
 def _call_gemini_with_retry(pdf_bytes: bytes) -> str:
-    """Calls Gemini API with retry logic. It now gets its own client instance."""
-    client = _get_gemini_client() # Each call in a worker gets a fresh client.
+    """Calls Gemini API with retry logic, reusing the process-wide client."""
+    client = _get_gemini_client()
     for attempt in range(LLM_MAX_RETRIES):
         try:
-            config = types.GenerateContentConfig(
-                response_mime_type="application/json",
-                temperature=0.0,
-                response_schema=types.Schema(
-                    type=types.Type.OBJECT,
-                    properties={'statements_found': types.Schema(type=types.Type.ARRAY, items=STATEMENT_SCHEMA)},
-                    required=['statements_found']
-                )
-            )
             response = client.models.generate_content(
                 model=ISOLATION_MODEL,
                 contents=[ISOLATION_PROMPT, types.Part.from_bytes(data=pdf_bytes, mime_type="application/pdf")],
-                config=config
+                config=ISOLATION_CONFIG
             )
             if not response.text:
                 raise ValueError("LLM returned an empty response.")
@@ -157,16 +186,80 @@ def _call_gemini_with_retry(pdf_bytes: bytes) -> str:
             time.sleep(LLM_INITIAL_BACKOFF * (2 ** attempt))
     raise RuntimeError("LLM call failed after all retry attempts.")
 
+def _rasterize_pdf(pdf_bytes: bytes) -> bytes:
+    """Re-render every page as a JPEG at LLM_PDF_RASTER_DPI, one page at a time to bound memory."""
+    out_pdf = pikepdf.Pdf.new()
+    src = pypdfium2.PdfDocument(pdf_bytes)
+    try:
+        for i in range(len(src)):
+            page = src[i]
+            width_pt, height_pt = page.get_size()
+            image = page.render(scale=LLM_PDF_RASTER_DPI / 72).to_pil().convert("RGB")
+            page.close()
+            jpeg = io.BytesIO()
+            image.save(jpeg, format="JPEG", quality=LLM_PDF_JPEG_QUALITY)
+
+            image_stream = pikepdf.Stream(out_pdf, jpeg.getvalue())
+            image_stream.Type = pikepdf.Name.XObject
+            image_stream.Subtype = pikepdf.Name.Image
+            image_stream.Width, image_stream.Height = image.size
+            image_stream.ColorSpace = pikepdf.Name.DeviceRGB
+            image_stream.BitsPerComponent = 8
+            image_stream.Filter = pikepdf.Name.DCTDecode
+
+            out_page = out_pdf.add_blank_page(page_size=(width_pt, height_pt))
+            image_name = out_page.add_resource(image_stream, pikepdf.Name.XObject)
+            out_page.contents_add(pikepdf.Stream(
+                out_pdf, f"q {width_pt:.2f} 0 0 {height_pt:.2f} 0 0 cm {image_name} Do Q".encode()
+            ))
+    finally:
+        src.close()
+    out = io.BytesIO()
+    out_pdf.save(out, compress_streams=True)
+    return out.getvalue()
+
+def _compress_pdf_for_llm(pdf_bytes: bytes) -> bytes:
+    """
+    Shrink the PDF uploaded for layout detection; the original is still used for splitting.
+    Lossless restructure with pikepdf first, then rasterization for filings that are still huge.
+    Returns the original bytes if the optional libraries are missing or compression fails.
+    """
+    smallest = pdf_bytes
+    try:
+        if pikepdf is not None:
+            out = io.BytesIO()
+            with pikepdf.open(io.BytesIO(pdf_bytes)) as pdf:
+                pdf.save(out, compress_streams=True, object_stream_mode=pikepdf.ObjectStreamMode.generate)
+            if out.getbuffer().nbytes < len(smallest):
+                smallest = out.getvalue()
+            if pypdfium2 is not None and len(smallest) > LLM_PDF_RASTER_THRESHOLD:
+                rasterized = _rasterize_pdf(pdf_bytes)
+                if len(rasterized) < len(smallest):
+                    smallest = rasterized
+    except Exception as e:
+        logging.warning(f"Could not compress PDF for the LLM, sending the original: {e}")
+    if len(smallest) < len(pdf_bytes):
+        logging.info(f"   Compressed PDF for the LLM: {len(pdf_bytes) / 1e6:.1f} MB -> {len(smallest) / 1e6:.1f} MB")
+    return smallest
+
 def get_document_layout(pdf_bytes: bytes) -> list:
     """Step 1: Get document layout from the LLM."""
     logging.info("   [Step 1/2] Running reconnaissance to find and map core statements.")
-    response_text = _call_gemini_with_retry(pdf_bytes)
+    # Same PDF + prompt + schema/config + model + parser version => same layout; skip the model on an identical rerun
+    cache_key = make_cache_key(pdf_bytes, ISOLATION_PROMPT, _CACHE_KEY_CONFIG, ISOLATION_MODEL, PARSER_VERSION)
+    cached_text = get_cached_response(cache_key)
+    if cached_text is not None:
+        logging.info("   Using cached layout response.")
+    # The key stays on the original bytes; only a cache miss pays for compression
+    response_text = cached_text if cached_text is not None else _call_gemini_with_retry(_compress_pdf_for_llm(pdf_bytes))
     try:
         data = json.loads(response_text)
         statements_found = data.get("statements_found")
         if not isinstance(statements_found, list):
             raise ValueError("Invalid data type for 'statements_found' in response.")
         logging.info(f"   Found {len(statements_found)} core statements.")
+        if cached_text is None:
+            store_response(cache_key, response_text)  # only well-formed layouts are cached
         return statements_found
     except (json.JSONDecodeError, ValueError) as e:
         logging.error(f"Failed to parse layout: {e}. Response was: {response_text}")
@@ -183,35 +276,80 @@ def get_filing_metadata(session: SQLAlchemySession, asset_id: int) -> Dict[str,
     quarter_str = f"Q{result.quarter}{result.fiscal_year}"
     return {"ticker": result.ticker, "period": quarter_str}
 
-def isolate_and_save_statements(source_pdf_path: Path, statements: list, filing_metadata: Dict[str, Any]) -> Dict[str, str]:
-    """Step 2: Create individual PDFs for each statement."""
+def get_filing_metadata_bulk(session: SQLAlchemySession, asset_ids: list) -> Dict[int, Dict[str, Any]]:
+    """Ticker and period for many assets in one query (asset_id -> metadata); unmatched assets are absent."""
+    if not asset_ids:
+        return {}
+    stmt = select(JobAssetLink.asset_id, IngestionJob.ticker, IngestionJob.fiscal_year, IngestionJob.quarter)\
+        .join(IngestionJob, IngestionJob.job_id == JobAssetLink.job_id)\
+        .where(JobAssetLink.asset_id.in_(asset_ids))\
+        .order_by(JobAssetLink.asset_id, IngestionJob.job_id)
+    metadata_by_asset = {}
+    for row in session.execute(stmt):
+        if row.asset_id not in metadata_by_asset:  # first job per asset wins
+            metadata_by_asset[row.asset_id] = {"ticker": row.ticker, "period": f"Q{row.quarter}{row.fiscal_year}"}
+    return metadata_by_asset
+
+def isolate_and_save_statements(
+    source_pdf_path: Path, statements: list, filing_metadata: Dict[str, Any], pdf_bytes: Optional[bytes] = None
+) -> Dict[str, str]:
+    """
+    Step 2: Create individual PDFs for each statement.
+    Pass `pdf_bytes` when the caller already holds the PDF in memory, to avoid re-reading the file.
+    The source is opened once and shared by every statement; page copying uses pikepdf (qpdf)
+    when installed, otherwise PyPDF2.
+    """
     logging.info("   [Step 2/2] Creating individual statement PDFs.")
     ticker_period_dir = PROCESSED_PDF_DIR / filing_metadata['ticker'] / filing_metadata['period']
     ticker_period_dir.mkdir(parents=True, exist_ok=True)
     saved_paths = {}
+    source = io.BytesIO(pdf_bytes) if pdf_bytes is not None else source_pdf_path
+    src_pdf = None
     try:
-        reader = PdfReader(source_pdf_path)
-        total_pages = len(reader.pages)
+        if pikepdf is not None:
+            src_pdf = pikepdf.open(source)
+            source_pages = src_pdf.pages
+        else:
+            source_pages = PdfReader(source).pages
+        total_pages = len(source_pages)
         for stmt in statements:
             mapping, start_page, end_page = stmt.get('mapping'), stmt.get('start_page'), stmt.get('end_page')
             if not all([mapping, start_page, end_page]) or not (0 < start_page <= end_page <= total_pages):
                 logging.warning(f"Invalid page range for {mapping}: {start_page}-{end_page} (total: {total_pages}). Skipping.")
                 continue
             isolated_pdf_path = ticker_period_dir / f"{mapping}.pdf"
-            writer = PdfWriter()
-            for page_num in range(start_page, end_page + 1):
-                writer.add_page(reader.pages[page_num - 1])
-            with open(isolated_pdf_path, "wb") as out_f:
-                writer.write(out_f)
+            if src_pdf is not None:
+                out_pdf = pikepdf.Pdf.new()
+                out_pdf.pages.extend(source_pages[start_page - 1:end_page])
+                # Compressed streams keep the per-statement upload in the extraction step small
+                out_pdf.save(
+                    isolated_pdf_path, compress_streams=True,
+                    object_stream_mode=pikepdf.ObjectStreamMode.generate
+                )
+                out_pdf.close()
+            else:
+                writer = PdfWriter()
+                for page_num in range(start_page, end_page + 1):
+                    writer.add_page(source_pages[page_num - 1])
+                with open(isolated_pdf_path, "wb") as out_f:
+                    writer.write(out_f)
             saved_paths[mapping] = str(isolated_pdf_path.relative_to(project_root))
             logging.info(f"      -> Saved {mapping} to {isolated_pdf_path.name}")
     except Exception as e:
         logging.error(f"Error during PDF processing for {source_pdf_path.name}: {e}", exc_info=True)
         raise
+    finally:
+        if src_pdf is not None:
+            src_pdf.close()
     return saved_paths
 
-def process_single_asset_isolation(asset_id: int, session: SQLAlchemySession):
-    """Main isolation function for a single PDF asset with robust error handling."""
+def process_single_asset_isolation(
+    asset_id: int, session: SQLAlchemySession, filing_metadata: Optional[Dict[str, Any]] = None
+):
+    """
+    Main isolation function for a single PDF asset with robust error handling.
+    `filing_metadata` is the prefetched ticker/period; looked up here when not supplied.
+    """
     try:
         asset = session.get(RawDataAsset, asset_id)
         if not asset or not asset.storage_location:
@@ -222,8 +360,12 @@ def process_single_asset_isolation(asset_id: int, session: SQLAlchemySession):
         with open(source_pdf_path, "rb") as f:
             pdf_bytes = f.read()
         statements_found = get_document_layout(pdf_bytes)
-        filing_metadata = get_filing_metadata(session, asset_id)
-        isolated_paths = isolate_and_save_statements(source_pdf_path, statements_found, filing_metadata)
+        if filing_metadata is None:
+            filing_metadata = get_filing_metadata(session, asset_id)
+        # Split from the bytes already read for the LLM (BytesIO shares the buffer) instead of re-reading the file
+        isolated_paths = isolate_and_save_statements(
+            source_pdf_path, statements_found, filing_metadata, pdf_bytes=pdf_bytes
+        )
         if not isolated_paths:
             raise RuntimeError(f"No statements were successfully isolated from {len(statements_found)} found.")
         content_for_db = {
@@ -242,7 +384,7 @@ def process_single_asset_isolation(asset_id: int, session: SQLAlchemySession):
             "parse_status": "ISOLATION_ERROR", "content": None, "error_details": f"Isolation failed: {str(e)}"
         })
 
-def _execute_isolation_for_worker(asset_id: int):
+def _execute_isolation_for_worker(asset_id: int, filing_metadata: Optional[Dict[str, Any]] = None):
     """
     Worker function for multiprocessing. It now creates its own
     database session to be completely independent.
@@ -250,25 +392,38 @@ def _execute_isolation_for_worker(asset_id: int):
     try:
         # Each worker process gets its own session
         with get_session() as db_session:
-            process_single_asset_isolation(asset_id, db_session)
+            process_single_asset_isolation(asset_id, db_session, filing_metadata)
     except Exception as e:
         logging.error(f"Worker process for Asset ID {asset_id} crashed: {e}", exc_info=True)
     finally:
         pass  # No longer needed - each process has its own engine
 
+def get_pending_isolation_asset_ids(session: SQLAlchemySession) -> list:
+    """PDF assets not yet isolated by this parser version."""
+    processed_assets_subquery = select(ParsedDocument.asset_id).where(ParsedDocument.parser_version == PARSER_VERSION)
+    unprocessed_assets_query = select(RawDataAsset.asset_id).where(
+        RawDataAsset.source_type == 'PDF_FILE',
+        RawDataAsset.asset_id.notin_(processed_assets_subquery)
+    )
+    return session.execute(unprocessed_assets_query).scalars().all()
+
+def submit_isolations(
+    executor: concurrent.futures.Executor, asset_ids: list, metadata_by_asset: Dict[int, Dict[str, Any]]
+) -> Dict[concurrent.futures.Future, int]:
+    """Submit one isolation job per asset, with its prefetched metadata; returns {future: asset_id}."""
+    return {
+        executor.submit(_execute_isolation_for_worker, asset_id, metadata_by_asset.get(asset_id)): asset_id
+        for asset_id in asset_ids
+    }
+
 def run_isolator_batch():
     """Main batch processing function for statement isolation."""
-    MAX_WORKERS = 1
     logging.info(f"--- Starting PDF Isolator Batch Run v{PARSER_VERSION} ---")
 
     # The main process gets the list of work.
     with get_session() as session:
-        processed_assets_subquery = select(ParsedDocument.asset_id).where(ParsedDocument.parser_version == PARSER_VERSION)
-        unprocessed_assets_query = select(RawDataAsset.asset_id).where(
-            RawDataAsset.source_type == 'PDF_FILE',
-            RawDataAsset.asset_id.notin_(processed_assets_subquery)
-        )
-        asset_ids_to_process = session.execute(unprocessed_assets_query).scalars().all()
+        asset_ids_to_process = get_pending_isolation_asset_ids(session)
+        metadata_by_asset = get_filing_metadata_bulk(session, asset_ids_to_process)
 
     if not asset_ids_to_process:
         logging.info("No new PDF assets to process for isolation.")
@@ -277,7 +432,10 @@ def run_isolator_batch():
     logging.info(f"Found {len(asset_ids_to_process)} PDF assets for isolation. Using {MAX_WORKERS} workers.")
     # The ProcessPoolExecutor now calls the safe worker function
     with concurrent.futures.ProcessPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        list(executor.map(_execute_isolation_for_worker, asset_ids_to_process))
+        list(executor.map(
+            _execute_isolation_for_worker,
+            asset_ids_to_process, [metadata_by_asset.get(asset_id) for asset_id in asset_ids_to_process]
+        ))
 
     logging.info("--- Isolator batch run completed. ---")
 
@@ -11,7 +11,9 @@ Designed for production deployment as a Docker service with comprehensive
 error handling, monitoring, and resource management.
 """
 
+import concurrent.futures
 import logging
+import multiprocessing
 import sys
 import time
 from pathlib import Path
@@ -21,8 +23,21 @@ from typing import Optional
 project_root = Path(__file__).resolve().parents[2]
 sys.path.append(str(project_root))
 
-from earnings_agent.parsing.pdf.pdf_isolator_task import run_isolator_batch
-from earnings_agent.parsing.pdf.pdf_extractor_task import run_extractor_batch
+from earnings_agent.storage.database import get_session, DB_POOL_SIZE, DB_MAX_OVERFLOW
+from earnings_agent.parsing.pdf.pdf_isolator_task import (
+    run_isolator_batch,
+    get_pending_isolation_asset_ids,
+    submit_isolations,
+    get_filing_metadata_bulk as get_isolation_metadata_bulk,
+    MAX_WORKERS as ISOLATOR_MAX_WORKERS
+)
+from earnings_agent.parsing.pdf.pdf_extractor_task import (
+    run_extractor_batch,
+    get_pending_extraction_doc_ids,
+    submit_extractions,
+    get_filing_metadata_bulk as get_extraction_metadata_bulk,
+    MAX_WORKERS as EXTRACTOR_MAX_WORKERS
+)
 
 # --- Configuration ---
 COORDINATOR_VERSION = "parser-version-1.0"  # Unified version for the complete PDF parsing pipeline
@@ -130,12 +145,79 @@ class PDFParsingCoordinator:
             logger.error(f"❌ {error_msg}", exc_info=True)
             return False
     
-    def run_complete_pipeline(self, skip_isolation: bool = False) -> bool:
+    def run_pipelined_phases(self) -> bool:
+        """
+        Execute isolation and extraction concurrently: each asset is queued for extraction as
+        soon as its own isolation finishes, instead of after the whole isolation batch.
+        
+        Returns:
+            bool: True if successful, False if failed
+        """
+        logger.info("🔄 Starting Pipelined Isolation + Extraction Phases...")
+        phase_start = time.time()
+        
+        try:
+            with get_session() as session:
+                # Read the extraction backlog before any isolation runs, so a freshly isolated
+                # document can't be picked up by both this query and the per-asset one below
+                backlog_doc_ids = get_pending_extraction_doc_ids(session)
+                backlog_metadata = get_extraction_metadata_bulk(session, backlog_doc_ids)
+                asset_ids = get_pending_isolation_asset_ids(session)
+                asset_metadata = get_isolation_metadata_bulk(session, asset_ids)
+            logger.info(f"   Isolating {len(asset_ids)} assets; {len(backlog_doc_ids)} documents already pending extraction")
+            
+            submitted_doc_ids = set(backlog_doc_ids)
+            # Extraction threads share this process's connection pool with the coordinator below,
+            # so leave one connection free for its status lookups
+            extraction_workers = max(1, min(EXTRACTOR_MAX_WORKERS, DB_POOL_SIZE + DB_MAX_OVERFLOW - 1))
+            # "spawn" so isolation workers don't inherit this process's open DB connections
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=ISOLATOR_MAX_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            ) as isolation_pool, concurrent.futures.ThreadPoolExecutor(
+                max_workers=extraction_workers
+            ) as extraction_pool, get_session() as status_session:
+                extraction_futures = submit_extractions(extraction_pool, backlog_doc_ids, backlog_metadata)
+                isolation_futures = submit_isolations(isolation_pool, asset_ids, asset_metadata)
+                
+                for future in concurrent.futures.as_completed(isolation_futures):
+                    future.result()
+                    new_doc_ids = [
+                        doc_id for doc_id in get_pending_extraction_doc_ids(status_session, [isolation_futures[future]])
+                        if doc_id not in submitted_doc_ids
+                    ]
+                    new_metadata = get_extraction_metadata_bulk(status_session, new_doc_ids)
+                    # End the read so no connection is held while waiting on the next isolation
+                    status_session.commit()
+                    submitted_doc_ids.update(new_doc_ids)
+                    extraction_futures += submit_extractions(extraction_pool, new_doc_ids, new_metadata)
+                
+                for future in concurrent.futures.as_completed(extraction_futures):
+                    future.result()
+            
+            duration = time.time() - phase_start
+            for phase in ('isolation', 'extraction'):
+                self.phase_stats[phase] = {'status': 'completed', 'duration': duration, 'error': None}
+            
+            logger.info(f"✅ Pipelined phases completed successfully in {duration:.2f} seconds")
+            return True
+            
+        except Exception as e:
+            duration = time.time() - phase_start
+            error_msg = f"Pipelined Isolation + Extraction failed: {str(e)}"
+            
+            for phase in ('isolation', 'extraction'):
+                self.phase_stats[phase] = {'status': 'failed', 'duration': duration, 'error': error_msg}
+            
+            logger.error(f"❌ {error_msg}", exc_info=True)
+            return False
+    
+    def run_complete_pipeline(self, skip_isolation: bool = False, pipeline: bool = False) -> bool:
         """
         Execute the complete PDF parsing pipeline.
         
         Args:
             skip_isolation: If True, skip isolation phase (useful for reprocessing)
+            pipeline: If True, overlap the two phases per asset instead of running them back to back
             
         Returns:
             bool: True if pipeline completed successfully, False otherwise
@@ -145,6 +227,13 @@ class PDFParsingCoordinator:
         logger.info(f"🚀 Starting Complete PDF Parsing Pipeline v{COORDINATOR_VERSION}")
         logger.info("="*80)
         
+        if pipeline and not skip_isolation:
+            success = self.run_pipelined_phases()
+            if not success:
+                logger.error("Pipeline terminated due to pipelined phase failure")
+            self._log_final_summary(success=success)
+            return success
+        
         # Phase 1: PDF Isolation
         if not skip_isolation:
             if not self.run_isolation_phase():
@@ -155,9 +244,6 @@ class PDFParsingCoordinator:
             logger.info("⏭️  Skipping PDF Isolation Phase (skip_isolation=True)")
             self.phase_stats['isolation']['status'] = 'skipped'
         
-        # Brief pause between phases for resource cleanup
-        time.sleep(2)
-        
         # Phase 2: Data Extraction
         if not self.run_extraction_phase():
             logger.error("Pipeline terminated due to extraction phase failure")
@@ -207,6 +293,7 @@ def main():
 Examples:
   python pdf_parser_task.py                    # Run complete pipeline
   python pdf_parser_task.py --skip-isolation   # Skip isolation, run extraction only
+  python pdf_parser_task.py --pipeline         # Extract each asset as soon as it is isolated
         """
     )
     
@@ -216,6 +303,12 @@ Examples:
         help='Skip the PDF isolation phase (useful for reprocessing extractions)'
     )
     
+    parser.add_argument(
+        '--pipeline',
+        action='store_true',
+        help='Overlap isolation and extraction per asset instead of running the phases back to back'
+    )
+    
     parser.add_argument(
         '--version',
         action='version',
@@ -228,7 +321,9 @@ Examples:
     coordinator = PDFParsingCoordinator()
     
     try:
-        success = coordinator.run_complete_pipeline(skip_isolation=args.skip_isolation)
+        success = coordinator.run_complete_pipeline(
+            skip_isolation=args.skip_isolation, pipeline=args.pipeline
+        )
         exit_code = 0 if success else 1
         
     except KeyboardInterrupt:
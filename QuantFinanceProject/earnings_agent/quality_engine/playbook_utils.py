@@ -5,21 +5,22 @@ from typing import Dict, List, Any
 # Correct path within the Docker container
 PLAYBOOK_PATH = Path("/app/earnings_agent/playbooks/sebi/metrics/sebi_banking.yml")
 
-def _get_leaf_ids_recursive(nodes: List[Dict[str, Any]]) -> List[str]:
-    """Recursively traverses nodes to find all extractable leaf-node IDs."""
+def _get_leaf_ids(nodes: List[Dict[str, Any]]) -> List[str]:
+    """Walks the node tree (iteratively, in document order) to find all extractable leaf-node IDs."""
     leaf_ids = []
-    for node in nodes:
+    stack = list(reversed(nodes))
+    while stack:
+        node = stack.pop()
         children = node.get('children')
         if not children:
             # ONLY include leaves explicitly intended for extraction
             if node.get('extractable', True):
                 leaf_ids.append(node['id'])
         else:
-            leaf_ids.extend(_get_leaf_ids_recursive(children))
+            stack.extend(reversed(children))
     return leaf_ids
 
 
-
 def load_playbook_leaf_nodes() -> Dict[str, List[str]]:
     """
     Loads the SEBI banking playbook and returns a dictionary mapping each
@@ -44,7 +45,7 @@ def load_playbook_leaf_nodes() -> Dict[str, List[str]]:
                 else:
                     normalized_key = statement_key
 
-                leaf_nodes = _get_leaf_ids_recursive(doc.get('nodes', []))
+                leaf_nodes = _get_leaf_ids(doc.get('nodes', []))
                 
                 # For cash flow, both direct and indirect methods have many common leaves
                 if normalized_key == 'cash_flow':
@@ -2,7 +2,7 @@
 
 import os
 from dotenv import load_dotenv, find_dotenv
-from sqlalchemy import create_engine, update, select, delete, func 
+from sqlalchemy import create_engine, update, select, delete, func
 from sqlalchemy.orm import sessionmaker, joinedload, Session
 from sqlalchemy.dialects.postgresql import insert as pg_insert
 from typing import List, Dict, Any, Optional
@@ -45,6 +45,10 @@ DB_NAME = os.getenv("EARNINGS_DB_NAME", "quantdata")
 
 DATABASE_URL = f"postgresql+psycopg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
+# Per-process connection pool sizing (each worker process builds its own engine)
+DB_POOL_SIZE = int(os.getenv("EARNINGS_DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("EARNINGS_DB_MAX_OVERFLOW", "2"))
+
 # --- MODIFICATION START ---
 # These are now initialized to None. They will be created on a per-process basis.
 _engine = None
@@ -61,9 +65,10 @@ def get_engine():
             DATABASE_URL,
             echo=False,  # Set to True temporarily for SQL debug logs
             future=True,
-            pool_size=5,  # Matches your MAX_WORKERS +1
-            max_overflow=2,
+            pool_size=DB_POOL_SIZE,  # Matches your MAX_WORKERS +1 by default
+            max_overflow=DB_MAX_OVERFLOW,
             pool_pre_ping=True,  # Pings connections before use to detect closures
+            pool_use_lifo=True,  # Reuse the most recent connection so surplus idle ones age out via pool_recycle
             pool_recycle=300,  # Recycle idle connections every 5 min
             pool_reset_on_return='rollback',  # Rolls back any open transactions on return to pool
             pool_timeout=30,  # Wait 30s for a pool connection
@@ -237,6 +242,36 @@ def create_parsed_document(doc_data: Dict[str, Any]):
     finally:
         session.close()
 
+def create_parsed_documents_bulk(rows: List[Dict[str, Any]]):
+    """
+    Bulk variant of create_parsed_document: upserts all rows with one executemany per row
+    shape and a single commit. Rows may carry different optional keys (e.g. content vs.
+    error_details); grouping by key set leaves absent columns out of the INSERT, exactly as
+    the single-row insert does (filling them with None would store JSON 'null' in content).
+    """
+    if not rows:
+        return
+    rows_by_shape: Dict[frozenset, List[Dict[str, Any]]] = {}
+    for row in rows:
+        rows_by_shape.setdefault(frozenset(row), []).append(row)
+    session = get_session()
+    try:
+        stmt = pg_insert(ParsedDocument)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['asset_id', 'parser_version'],
+            set_={
+                'parse_status': stmt.excluded.parse_status,
+                'error_details': stmt.excluded.error_details,
+                'parsed_at': stmt.excluded.parsed_at,
+                'content': stmt.excluded.content
+            }
+        )
+        for shape_rows in rows_by_shape.values():
+            session.execute(stmt, shape_rows)
+        session.commit()
+    finally:
+        session.close()
+
 # # ================================================================================================
 # # NORMALIZATION STAGE FUNCTIONS (NEW)
 # # ================================================================================================
@@ -250,6 +285,70 @@ def create_parsed_document(doc_data: Dict[str, Any]):
 #         return session.get(LabelMapping, (raw_label, industry))
 #     finally:
 #         session.close()
+# try:
+#     import redis
+# except ImportError:  # Redis is an optional read-through cache
+#     redis = None
+# # Optional Redis cache for read-mostly lookups (same Redis service Superset uses, separate DB)
+# REDIS_URL = os.getenv("EARNINGS_REDIS_URL", "redis://redis:6379/2")
+# LABEL_MAPPING_CACHE_TTL = 86400  # 1 day
+# _redis_client = None
+# def get_redis():
+#     """
+#     Return a process-local Redis client, or None if redis isn't installed/configured.
+#     Callers must treat the cache as best-effort and fall back to Postgres.
+#     """
+#     global _redis_client
+#     if _redis_client is None and redis is not None and REDIS_URL:
+#         _redis_client = redis.Redis.from_url(REDIS_URL, socket_timeout=2, decode_responses=True)
+#     return _redis_client
+# def get_label_mappings_bulk(industry: str) -> Dict[str, LabelMapping]:
+#     """
+#     Retrieves every cached label mapping for an industry in a single query,
+#     keyed by raw_label. Replaces per-label get_label_mapping() lookups in hot loops.
+#     Reads through a Redis hash (lm_bulk:<industry>) when Redis is available; the
+#     cached entries are detached LabelMapping objects carrying normalized_label/status only.
+#     """
+#     cache_key = f"lm_bulk:{industry}"
+#     r = get_redis()
+#     if r is not None:
+#         try:
+#             cached = r.hgetall(cache_key)
+#             if cached:
+#                 return {
+#                     raw_label: LabelMapping(raw_label=raw_label, industry=industry, **json.loads(payload))
+#                     for raw_label, payload in cached.items()
+#                 }
+#         except redis.RedisError as e:
+#             logging.warning(f"Redis read failed for {cache_key}, falling back to DB: {e}")
+#
+#     session = get_session()
+#     try:
+#         mappings = session.query(LabelMapping).filter(LabelMapping.industry == industry).all()
+#         result = {m.raw_label: m for m in mappings}
+#     finally:
+#         session.close()
+#
+#     if r is not None and result:
+#         try:
+#             pipe = r.pipeline()
+#             pipe.hset(cache_key, mapping={
+#                 m.raw_label: json.dumps({'normalized_label': m.normalized_label, 'status': m.status})
+#                 for m in result.values()
+#             })
+#             pipe.expire(cache_key, LABEL_MAPPING_CACHE_TTL)
+#             pipe.execute()
+#         except redis.RedisError as e:
+#             logging.warning(f"Redis write failed for {cache_key}: {e}")
+#     return result
+# def _invalidate_label_mapping_cache(industry: str):
+#     r = get_redis()
+#     if r is None:
+#         return
+#     try:
+#         r.delete(f"lm_bulk:{industry}")
+#     except redis.RedisError as e:
+#         logging.warning(f"Redis invalidation failed for industry {industry}: {e}")
 # def upsert_label_mapping(mapping_data: Dict[str, Any]):
 #     """
 #     Inserts or updates a label mapping in the cache.
@@ -273,6 +372,7 @@ def create_parsed_document(doc_data: Dict[str, Any]):
 #         session.commit()
 #     finally:
 #         session.close()
+#     _invalidate_label_mapping_cache(mapping_data['industry'])
 # def create_staged_normalized_data(data: Dict[str, Any]):
 #     """
 #     Inserts a record in the staging table for normalized data.
@@ -333,35 +433,153 @@ def create_parsed_document(doc_data: Dict[str, Any]):
 # def fetch_pending_label_reviews() -> List[LabelMapping]:
 #     """
 #     Queries the database for all label mappings with 'PENDING_REVIEW' status.
+#     Only the list-view columns are loaded; fetch source_context on demand with
+#     get_label_source_contexts() (it is deferred here and unavailable once detached).
 #     """
 #     session = get_session()
 #     try:
-#         return session.query(LabelMapping).filter(
+#         return session.query(LabelMapping).options(
+#             load_only(
+#                 LabelMapping.raw_label, LabelMapping.industry, LabelMapping.normalized_label,
+#                 LabelMapping.status, LabelMapping.created_at
+#             )
+#         ).filter(
 #             LabelMapping.status == 'PENDING_REVIEW'
 #         ).order_by(LabelMapping.created_at.desc()).all()
 #     finally:
 #         session.close()
+# def get_label_source_contexts(keys: List[tuple]) -> Dict[tuple, Dict[str, Any]]:
+#     """
+#     Returns {(raw_label, industry): source_context} for the given composite keys in one query.
+#     """
+#     if not keys:
+#         return {}
+#     session = get_session()
+#     try:
+#         rows = session.execute(
+#             select(LabelMapping.raw_label, LabelMapping.industry, LabelMapping.source_context)
+#             .where(tuple_(LabelMapping.raw_label, LabelMapping.industry).in_(keys))
+#         ).all()
+#         return {(row.raw_label, row.industry): row.source_context for row in rows}
+#     finally:
+#         session.close()
+# def fetch_first_figure_contexts(raw_labels: List[str]) -> Dict[str, Dict[str, Any]]:
+#     """
+#     Returns {raw_label: {value, representation, currency_context}} for the first staged
+#     document (lowest doc_id) containing each label, in a single query.
+#     Each label is located with its own @> containment probe, so the jsonb_path_ops GIN index
+#     on statement_analyses applies; only that one document per label is unnested.
+#     Labels that don't appear in any staged document are absent from the result.
+#     """
+#     if not raw_labels:
+#         return {}
+#     sql = """
+#     SELECT
+#         l.label,
+#         f.value,
+#         f.representation,
+#         f.currency_context
+#     FROM
+#         unnest(CAST(:labels AS text[])) AS l(label)
+#         CROSS JOIN LATERAL (
+#             SELECT doc_id, normalized_data
+#             FROM earnings_data.staged_normalized_data
+#             WHERE
+#                 normalized_data -> 'unit_normalized_data' -> 'llm_unit_analysis' -> 'statement_analyses'
+#                     @> jsonb_build_array(jsonb_build_object('figures', jsonb_build_array(jsonb_build_object('label', l.label))))
+#             ORDER BY doc_id
+#             LIMIT 1
+#         ) AS first_doc
+#         CROSS JOIN LATERAL (
+#             SELECT
+#                 -- Non-numeric values come back as NULL instead of aborting the whole batch
+#                 CASE WHEN jsonb_typeof(figure -> 'value') = 'number'
+#                     THEN (figure ->> 'value')::numeric END AS value,
+#                 figure ->> 'representation' AS representation,
+#                 figure ->> 'currency_context' AS currency_context
+#             FROM
+#                 jsonb_to_recordset(first_doc.normalized_data -> 'unit_normalized_data' -> 'llm_unit_analysis' -> 'statement_analyses') AS analysis(figures JSONB),
+#                 jsonb_array_elements(analysis.figures) AS figure
+#             WHERE
+#                 figure ->> 'label' = l.label
+#             LIMIT 1
+#         ) AS f
+#     """
+#     session = get_session()
+#     try:
+#         rows = session.execute(text(sql), {'labels': list(raw_labels)}).all()
+#         return {
+#             row.label: {
+#                 "value": row.value,
+#                 "representation": row.representation,
+#                 "currency_context": row.currency_context
+#             }
+#             for row in rows
+#         }
+#     finally:
+#         session.close()
 # # Add `new_label` as an optional parameter
-# def update_label_mapping_status(raw_label: str, industry: str, new_status: str, new_label: str = None, reviewer: str = "human_reviewer"):
+# def update_label_mapping_status(raw_label: str, industry: str, new_status: str, new_label: str = None, reviewer: str = "human_reviewer") -> bool:
+#     """
+#     Updates the status and optionally the normalized_label of a mapping in a single
+#     UPDATE ... RETURNING round-trip. Returns True if the mapping existed and was updated.
+#     """
+#     values = {
+#         'status': new_status,
+#         'last_reviewed_at': datetime.datetime.now(timezone.utc),
+#         'reviewed_by': reviewer
+#     }
+#     if new_label is not None:
+#         values['normalized_label'] = None if new_label.lower() == 'null' or not new_label else new_label
+#     session = get_session()
+#     try:
+#         stmt = (
+#             update(LabelMapping)
+#             .where(LabelMapping.raw_label == raw_label, LabelMapping.industry == industry)
+#             .values(**values)
+#             .returning(LabelMapping.raw_label)
+#         )
+#         updated = session.execute(stmt).first() is not None
+#         session.commit()
+#     except Exception as e:
+#         session.rollback()
+#         raise e
+#     finally:
+#         session.close()
+#     if updated:
+#         _invalidate_label_mapping_cache(industry)
+#     return updated
+# def bulk_update_label_mapping_status(rows: List[tuple], new_status: str, reviewer: str = "human_reviewer"):
 #     """
-#     Updates the status and optionally the normalized_label of a mapping.
+#     Updates many mappings in one transaction. `rows` are (raw_label, industry, new_label)
+#     tuples; new_label follows the same 'null'/empty convention as update_label_mapping_status.
 #     """
+#     if not rows:
+#         return
+#     now = datetime.datetime.now(timezone.utc)
+#     params = [
+#         {
+#             'raw_label': raw_label,
+#             'industry': industry,
+#             'status': new_status,
+#             'normalized_label': None if not new_label or new_label.lower() == 'null' else new_label,
+#             'last_reviewed_at': now,
+#             'reviewed_by': reviewer
+#         }
+#         for raw_label, industry, new_label in rows
+#     ]
 #     session = get_session()
 #     try:
-#         mapping_to_update = session.get(LabelMapping, (raw_label, industry))
-#         if mapping_to_update:
-#             mapping_to_update.status = new_status
-#             # --- CORRECTED LINE ---
-#             mapping_to_update.last_reviewed_at = datetime.datetime.now(timezone.utc)
-#             mapping_to_update.reviewed_by = reviewer
-#             if new_label is not None:
-#                 mapping_to_update.normalized_label = None if new_label.lower() == 'null' or not new_label else new_label
-#             session.commit()
+#         # ORM bulk UPDATE by primary key: a single executemany, one commit
+#         session.execute(update(LabelMapping), params)
+#         session.commit()
 #     except Exception as e:
 #         session.rollback()
 #         raise e
 #     finally:
 #         session.close()
+#     for industry in {row[1] for row in rows}:
+#         _invalidate_label_mapping_cache(industry)
 # def get_docs_pending_statement_normalization() -> List[int]:
 #     """
 #     Return all doc_ids that have not yet run through the statement normalizer.
@@ -489,16 +707,36 @@ def create_parsed_document(doc_data: Dict[str, Any]):
 #         session.commit()
 #     finally:
 #         session.close()
-# def get_pending_unit_reviews() -> List[UnitReviewQueue]:
+# def get_pending_unit_reviews() -> List[Any]:
 #     """
-#     Fetches all unit reviews that are pending human review.
+#     Fetches all unit reviews that are pending human review, as lightweight rows
+#     (id, ticker, fiscal_date, low_confidence_count, status, created_at) without the
+#     JSONB payloads. Load the full record with get_unit_review_detail().
 #     """
 #     session = get_session()
 #     try:
-#         stmt = select(UnitReviewQueue).where(
+#         stmt = select(
+#             UnitReviewQueue.id,
+#             UnitReviewQueue.ticker,
+#             UnitReviewQueue.fiscal_date,
+#             func.coalesce(
+#                 UnitReviewQueue.filing_data['low_confidence_count'].astext.cast(Integer), 0
+#             ).label('low_confidence_count'),
+#             UnitReviewQueue.status,
+#             UnitReviewQueue.created_at
+#         ).where(
 #             UnitReviewQueue.status == 'PENDING_REVIEW'
 #         ).order_by(UnitReviewQueue.created_at.desc())
-#         return session.execute(stmt).scalars().all()
+#         return session.execute(stmt).all()
+#     finally:
+#         session.close()
+# def get_unit_review_detail(review_id: int) -> Optional[UnitReviewQueue]:
+#     """
+#     Fetches a single unit review including its llm_analysis and filing_data payloads.
+#     """
+#     session = get_session()
+#     try:
+#         return session.get(UnitReviewQueue, review_id)
 #     finally:
 #         session.close()
 # def approve_unit_review(review_id: int, corrections: Dict = None):
@@ -692,4 +930,17 @@ def get_company_context(session: Session, ticker: str) -> CompanyMaster | None:
     return session.query(CompanyMaster).\
         options(joinedload(CompanyMaster.classification)).\
         filter(CompanyMaster.ticker == ticker).\
-        first()
\ No newline at end of file
+        first()
+
+def get_company_contexts(session: Session, tickers) -> Dict[str, CompanyMaster]:
+    """
+    Bulk variant of get_company_context: one query for many tickers, keyed by ticker.
+    """
+    tickers = set(tickers)
+    if not tickers:
+        return {}
+    companies = session.query(CompanyMaster).\
+        options(joinedload(CompanyMaster.classification)).\
+        filter(CompanyMaster.ticker.in_(tickers)).\
+        all()
+    return {c.ticker: c for c in companies}
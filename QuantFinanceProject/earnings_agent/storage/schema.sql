@@ -149,8 +149,37 @@ COMMENT ON TABLE earnings_data.parsed_documents IS 'Staging table for structured
 
 -- CREATE INDEX IF NOT EXISTS idx_staged_normalization_status
 --     ON earnings_data.staged_normalized_data(statement_normalized, unit_review_status, label_review_status);
+-- -- GIN index for `statement_analyses @> '[{"figures": [{"label": ...}]}]'` lookups (label review UI).
+-- -- jsonb_path_ops: smaller and faster than the default jsonb_ops, and @> is the only operator we need.
+-- -- On an existing database create it with CREATE INDEX CONCURRENTLY to avoid locking the table.
+-- CREATE INDEX IF NOT EXISTS idx_snd_stmt_analyses_gin
+--     ON earnings_data.staged_normalized_data
+--     USING GIN ((normalized_data -> 'unit_normalized_data' -> 'llm_unit_analysis' -> 'statement_analyses') jsonb_path_ops);
 -- CREATE INDEX IF NOT EXISTS idx_unit_review_pending 
 --     ON earnings_data.unit_review_queue(status, created_at);
+-- -- Single-column status indexes for the status report's GROUP BY counts: small enough
+-- -- for index-only scans (count(*) needs no other column). The composite indexes above
+-- -- lead with other columns and so can't serve a GROUP BY on these status columns directly.
+-- CREATE INDEX IF NOT EXISTS idx_snd_unit_status
+--     ON earnings_data.staged_normalized_data(unit_review_status);
+-- CREATE INDEX IF NOT EXISTS idx_snd_label_status
+--     ON earnings_data.staged_normalized_data(label_review_status);
+-- CREATE INDEX IF NOT EXISTS idx_label_mapping_status
+--     ON earnings_data.label_mapping_cache(status);
+-- -- Partial indexes for the normalizer's work queues (get_docs_pending_* and the staging
+-- -- anti-join). Each one only holds the rows still waiting on a phase, so it stays small
+-- -- as the processed history grows. staged_normalized_data(doc_id) is already indexed by
+-- -- its UNIQUE constraint, which serves the NOT EXISTS probe.
+-- CREATE INDEX IF NOT EXISTS idx_parsed_docs_parsed_ok
+--     ON earnings_data.parsed_documents(doc_id) WHERE parse_status = 'PARSED_OK';
+-- CREATE INDEX IF NOT EXISTS idx_snd_pending_statement
+--     ON earnings_data.staged_normalized_data(doc_id) WHERE statement_normalized = FALSE;
+-- CREATE INDEX IF NOT EXISTS idx_snd_pending_unit
+--     ON earnings_data.staged_normalized_data(doc_id)
+--     WHERE statement_normalized = TRUE AND unit_review_status = 'PENDING';
+-- CREATE INDEX IF NOT EXISTS idx_snd_pending_label
+--     ON earnings_data.staged_normalized_data(doc_id)
+--     WHERE label_review_status = 'PENDING' AND unit_review_status IN ('APPROVED', 'AUTO_APPROVED');
 
 -- ================================================================================================
 -- STAGE 3: QUALITY ENGINE